@@ -0,0 +1,102 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "importer")]
+
+import importer
+
+
+def build_lines(count):
+    lines = []
+    for i in range(count):
+        row = {
+            "patient_full_name": f"Пациент {i}",
+            "patient_birth_date": "1980-05-17",
+            "doctor_full_name": f"Врач {i % 500} Сергеевич",
+            "doctor_specialization": "Терапевт",
+            "department_name": f"Отделение №{i % 20}",
+            "appointment_date": f"2024-03-{1 + i % 28:02d} {8 + i % 10:02d}:{15 * (i % 4):02d}",
+            "complaints": "Кашель, температура",
+            "diagnosis_name": f"Диагноз {i % 1000}",
+        }
+        plaintext = json.dumps(row, ensure_ascii=False).encode("utf-8")
+        envelope = {"scheme": "plain", "payload": {"plaintext_b64": base64.b64encode(plaintext).decode("ascii")}}
+        lines.append(json.dumps(envelope).encode("utf-8"))
+    return lines
+
+
+# Reference copies of the decode path before the batch/fast-path change
+def legacy_decode(line):
+    obj = json.loads(line.decode("utf-8"))
+    plaintext = base64.b64decode(obj["payload"]["plaintext_b64"])
+    return json.loads(plaintext.decode("utf-8"))
+
+
+def legacy_parse_datetime(s):
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(s, fmt)
+        except Exception:
+            pass
+    return None
+
+
+def best_per_item(fn, count, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count * 1e6
+
+
+def run(messages, batch, repeat):
+    cfg = {}
+    lines = build_lines(messages)
+    buf = bytearray(b"\n".join(lines) + b"\n")
+    view = memoryview(buf)
+    views = []
+    start = 0
+    for line in lines:
+        views.append(view[start:start + len(line)])
+        start += len(line) + 1
+    batches = [views[i:i + batch] for i in range(0, len(views), batch)]
+    dates = [legacy_decode(line)["appointment_date"] for line in lines]
+    birth_dates = ["1980-05-17"] * messages
+
+    results = {
+        "decode_legacy_per_message": best_per_item(lambda: [legacy_decode(line) for line in lines], messages, repeat),
+        "decode_process_message": best_per_item(lambda: [importer.process_message(line, cfg) for line in lines], messages, repeat),
+        "decode_batch": best_per_item(lambda: [importer.decode_messages(b, cfg) for b in batches], messages, repeat),
+        "datetime_legacy": best_per_item(lambda: [legacy_parse_datetime(s) for s in dates], messages, repeat),
+        "datetime_fast": best_per_item(lambda: [importer.parse_datetime(s) for s in dates], messages, repeat),
+        "date_only_legacy": best_per_item(lambda: [legacy_parse_datetime(s) for s in birth_dates], messages, repeat),
+        "date_only_fast": best_per_item(lambda: [importer.parse_datetime(s) for s in birth_dates], messages, repeat),
+    }
+    return {
+        "meta": {"messages": messages, "batch": batch, "repeat": repeat, "json_backend": "orjson" if importer.orjson else "json"},
+        "results_us_per_message": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-message cost of the importer decode path, before and after")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500, help="lines per decode_messages call")
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs is reported")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    report = run(args.messages, args.batch, args.repeat)
+    for name, us in report["results_us_per_message"].items():
+        print(f"{name:28s} {us:8.2f} us/message")
+    print("JSON backend:", report["meta"]["json_backend"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,94 @@
+import argparse
+import base64
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "importer"))
+
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import importer
+
+
+def write_keypair(directory):
+    priv = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = os.path.join(directory, "bench_private.pem")
+    with open(path, "wb") as f:
+        f.write(priv.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ))
+    return path, priv.public_key()
+
+
+def rsa_encrypt(pubkey, data):
+    return pubkey.encrypt(
+        data,
+        padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+    )
+
+
+def make_payloads(pubkey, count, reuse_key):
+    plaintext = '{"patient_full_name": "Иванов Иван Иванович", "complaints": "Кашель"}'.encode("utf-8")
+    payloads = []
+    aes_key = enc_key = None
+    for _ in range(count):
+        if aes_key is None or not reuse_key:
+            aes_key = AESGCM.generate_key(bit_length=256)
+            enc_key = base64.b64encode(rsa_encrypt(pubkey, aes_key)).decode()
+        iv = os.urandom(12)
+        ct = AESGCM(aes_key).encrypt(iv, plaintext, None)
+        payloads.append({
+            "encrypted_key_b64": enc_key,
+            "iv_b64": base64.b64encode(iv).decode(),
+            "ciphertext_b64": base64.b64encode(ct).decode()
+        })
+    return payloads
+
+
+def decrypt_uncached(privkey_path, payload):
+    # The pre-cache code path: PEM parse and RSA unwrap on every message
+    priv = importer.load_rsa_privkey(privkey_path)
+    aes_key = importer.rsa_decrypt(priv, base64.b64decode(payload["encrypted_key_b64"]))
+    return AESGCM(aes_key).decrypt(base64.b64decode(payload["iv_b64"]), base64.b64decode(payload["ciphertext_b64"]), None)
+
+
+def measure(fn, privkey_path, payloads):
+    samples = []
+    for payload in payloads:
+        t0 = time.perf_counter()
+        fn(privkey_path, payload)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return {
+        "mean_us": round(statistics.fmean(samples), 1),
+        "p50_us": round(samples[len(samples) // 2], 1),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare decrypt_custom latency with and without key caching")
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        privkey_path, pubkey = write_keypair(tmp)
+        for reuse_key in (False, True):
+            payloads = make_payloads(pubkey, args.messages, reuse_key)
+            importer.session_key_cache.clear()
+            importer._privkey_cache.clear()
+            before = measure(decrypt_uncached, privkey_path, payloads)
+            after = measure(importer.decrypt_custom, privkey_path, payloads)
+            label = "reused session key" if reuse_key else "fresh key per message"
+            print(f"{label}: before={before} after={after}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+SPECIALIZATIONS = ["Терапевт", "Хирург", "Кардиолог", "Невролог", "Офтальмолог", "Педиатр", "Эндокринолог", "Онколог"]
+COMPLAINTS = ["Кашель, температура", "Боль в правом боку", "Плановый осмотр", "Боль в груди", "Головная боль",
+              "Послеоперационный осмотр", "Слабость", "Одышка"]
+
+
+def build_dimensions(rng, patients, doctors, departments, diagnoses):
+    department_names = [f"Отделение №{i}" for i in range(1, departments + 1)]
+    doctor_rows = [
+        (f"Врач {i} {rng.choice(['Сергеевич', 'Петровна', 'Иванович', 'Андреевна'])}",
+         rng.choice(SPECIALIZATIONS),
+         rng.choice(department_names))
+        for i in range(1, doctors + 1)
+    ]
+    birth_start = date(1940, 1, 1)
+    patient_rows = [
+        (f"Пациент {i}", (birth_start + timedelta(days=rng.randrange(365 * 80))).isoformat())
+        for i in range(1, patients + 1)
+    ]
+    diagnosis_names = [f"Диагноз {i}" for i in range(1, diagnoses + 1)]
+    return patient_rows, doctor_rows, diagnosis_names
+
+
+def iter_records(rng, rows, patient_rows, doctor_rows, diagnosis_names, duplicate_ratio, start, days):
+    recent = []
+    for _ in range(rows):
+        if recent and rng.random() < duplicate_ratio:
+            yield rng.choice(recent)
+            continue
+        patient_name, birth_date = rng.choice(patient_rows)
+        doctor_name, specialization, department = rng.choice(doctor_rows)
+        appointment = start + timedelta(days=rng.randrange(days), minutes=15 * rng.randrange(8 * 4 * 2))
+        record = (
+            patient_name,
+            birth_date,
+            doctor_name,
+            specialization,
+            department,
+            appointment.strftime("%Y-%m-%d %H:%M"),
+            rng.choice(COMPLAINTS),
+            rng.choice(diagnosis_names),
+        )
+        if len(recent) < 10000:
+            recent.append(record)
+        else:
+            recent[rng.randrange(10000)] = record
+        yield record
+
+
+def generate(path, rows, patients=100000, doctors=500, departments=20, diagnoses=1000, duplicate_ratio=0.05,
+             seed=42, start="2024-01-01", days=365, chunk_rows=10000):
+    rng = random.Random(seed)
+    patient_rows, doctor_rows, diagnosis_names = build_dimensions(rng, patients, doctors, departments, diagnoses)
+
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("DROP TABLE IF EXISTS hospital_records")
+    con.execute('''
+        CREATE TABLE hospital_records (
+            patient_full_name TEXT,
+            patient_birth_date TEXT,
+            doctor_full_name TEXT,
+            doctor_specialization TEXT,
+            department_name TEXT,
+            appointment_date TEXT,
+            complaints TEXT,
+            diagnosis_name TEXT
+        )
+    ''')
+    records = iter_records(rng, rows, patient_rows, doctor_rows, diagnosis_names, duplicate_ratio,
+                           datetime.fromisoformat(start).replace(hour=8), days)
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_rows:
+            con.executemany("INSERT INTO hospital_records VALUES (?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+            chunk = []
+    if chunk:
+        con.executemany("INSERT INTO hospital_records VALUES (?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+    con.commit()
+    con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill hospital_records with synthetic rows for benchmarks")
+    parser.add_argument("--sqlite", default="hospital_denormalized.db")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--doctors", type=int, default=500)
+    parser.add_argument("--departments", type=int, default=20)
+    parser.add_argument("--diagnoses", type=int, default=1000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05, help="share of rows that repeat an earlier row")
+    parser.add_argument("--start", default="2024-01-01")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    generate(args.sqlite, args.rows, args.patients, args.doctors, args.departments, args.diagnoses,
+             args.duplicate_ratio, args.seed, args.start, args.days)
+    print(f"Generated {args.rows} rows into {args.sqlite} in {time.perf_counter() - t0:.1f}s")
@@ -0,0 +1,358 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "importer"), os.path.join(ROOT, "exporter")]
+
+import psycopg2
+import settings
+
+SCENARIOS = ("import_row", "import_bulk", "socket", "rabbitmq", "report")
+SOURCE_TABLE = "hospital_records"
+
+
+def importer_config(opts):
+    return {
+        "mode": "rabbitmq" if opts["rabbit_url"] else "socket",
+        "socket": {"host": "127.0.0.1", "port": free_port(), "server": opts["server"]},
+        "rabbitmq": {"url": opts["rabbit_url"], "queue": "psu_lab_benchmark"},
+        "use_tls": False,
+        "use_custom_crypto": False,
+        "batch": {"enabled": opts["batch"], "max_rows": opts["batch_rows"], "max_wait_ms": 100},
+        "dimension_cache": {"enabled": opts["dimension_cache"], "size": 100000},
+        "postgres": dict(settings.config, pool_size=opts["pool_size"]),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Importer did not start listening on {host}:{port}")
+
+
+def reset_schema():
+    import setup_db
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        setup_db.create_tables(getattr(settings, "partitioned_appointments", False))
+    finally:
+        os.chdir(cwd)
+
+
+def source_row_count(sqlite_path):
+    import sqlite3
+    con = sqlite3.connect(sqlite_path)
+    try:
+        return con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
+    finally:
+        con.close()
+
+
+class CompletionLog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = []
+
+    def record(self, n):
+        now = time.perf_counter()
+        with self.lock:
+            self.times.extend([now] * n)
+
+    def wait_for(self, n, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.times) >= n:
+                    return True
+            time.sleep(0.01)
+        return False
+
+
+def instrument_importer(importer, log):
+    # Counts rows as they leave the importer's write path; the batch path is wrapped
+    # on its own because its row-by-row fallback would otherwise be counted twice
+    apply_row = importer.apply_normalization_and_insert
+    apply_batch = importer.apply_batch_and_insert
+
+    def timed_row(conn, row, dim_cache=None):
+        result = apply_row(conn, row, dim_cache)
+        log.record(1)
+        return result
+
+    def timed_batch(conn, rows, dim_cache=None):
+        importer.apply_normalization_and_insert = apply_row
+        try:
+            apply_batch(conn, rows, dim_cache)
+        finally:
+            importer.apply_normalization_and_insert = timed_row
+        log.record(len(rows))
+
+    importer.apply_normalization_and_insert = timed_row
+    importer.apply_batch_and_insert = timed_batch
+
+
+def latency_stats(send_times, done_times):
+    latencies = sorted((done - sent) * 1000.0 for sent, done in zip(send_times, done_times))
+    if not latencies:
+        return None, None
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return round(p50, 3), round(p99, 3)
+
+
+def send_all(exporter, transport, sqlite_path):
+    ctx = exporter.make_encode_context({}, SOURCE_TABLE)
+    send_times = []
+    for row in exporter.iter_rows_from_sqlite(sqlite_path, SOURCE_TABLE):
+        transport.send(exporter.build_message(row, ctx))
+        send_times.append(time.perf_counter())
+    transport.flush()
+    return send_times
+
+
+def run_import_row(opts):
+    import main
+    reset_schema()
+    t0 = time.perf_counter()
+    main.import_data(opts["sqlite"])
+    return {"rows": source_row_count(opts["sqlite"]), "seconds": time.perf_counter() - t0}
+
+
+def run_import_bulk(opts):
+    import main
+    reset_schema()
+    t0 = time.perf_counter()
+    main.import_data_bulk(opts["sqlite"])
+    return {"rows": source_row_count(opts["sqlite"]), "seconds": time.perf_counter() - t0}
+
+
+def run_socket(opts):
+    import exporter
+    import importer
+    cfg = importer_config(opts)
+    reset_schema()
+    log = CompletionLog()
+    instrument_importer(importer, log)
+    target = importer.run_async_socket_server if opts["server"] == "asyncio" else importer.run_socket_server
+    threading.Thread(target=target, args=(cfg,), daemon=True).start()
+    host, port = cfg["socket"]["host"], cfg["socket"]["port"]
+    wait_for_port(host, port)
+
+    transport = exporter.SocketTransport(host, port, {})
+    t0 = time.perf_counter()
+    send_times = send_all(exporter, transport, opts["sqlite"])
+    complete = log.wait_for(len(send_times), opts["timeout"])
+    elapsed = time.perf_counter() - t0
+    transport.close()
+    p50, p99 = latency_stats(send_times, log.times)
+    return {"rows": len(send_times), "seconds": elapsed, "p50_ms": p50, "p99_ms": p99, "complete": complete}
+
+
+class StandInChannel:
+    def basic_ack(self, delivery_tag, multiple=False):
+        pass
+
+
+def consume_standin(importer, cfg, deliveries):
+    # Mirrors run_rabbit_consumer without a broker: same callback, same batching and acks
+    db_conn = importer.get_db_conn(cfg)
+    dim_cache = importer.build_dimension_cache(cfg)
+    channel = StandInChannel()
+    writer = importer.build_batch_writer(cfg, db_conn, dim_cache, on_commit=lambda tags: None)
+    tag = 0
+    try:
+        while True:
+            try:
+                body = deliveries.get(timeout=0.05)
+            except queue.Empty:
+                if writer is not None:
+                    writer.flush_if_due()
+                continue
+            if body is None:
+                break
+            tag += 1
+            importer.on_rabbit_message(channel, SimpleNamespace(delivery_tag=tag), None, body, cfg, db_conn, dim_cache, writer)
+            if writer is not None:
+                writer.flush_if_due()
+        if writer is not None:
+            writer.flush()
+    finally:
+        db_conn.close()
+
+
+class StandInTransport:
+    def __init__(self, deliveries):
+        self.deliveries = deliveries
+
+    def send(self, message_bytes, marker=None):
+        self.deliveries.put(message_bytes)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.deliveries.put(None)
+
+
+def run_rabbitmq(opts):
+    import exporter
+    import importer
+    cfg = importer_config(opts)
+    reset_schema()
+    log = CompletionLog()
+    instrument_importer(importer, log)
+    if opts["rabbit_url"]:
+        threading.Thread(target=importer.run_rabbit_consumer, args=(cfg,), daemon=True).start()
+        transport = exporter.RabbitTransport(opts["rabbit_url"], cfg["rabbitmq"]["queue"], {"rabbitmq": {"confirm_batch": 500}})
+    else:
+        deliveries = queue.Queue(maxsize=max(1, opts["batch_rows"] * 2))
+        threading.Thread(target=consume_standin, args=(importer, cfg, deliveries), daemon=True).start()
+        transport = StandInTransport(deliveries)
+
+    t0 = time.perf_counter()
+    send_times = send_all(exporter, transport, opts["sqlite"])
+    complete = log.wait_for(len(send_times), opts["timeout"])
+    elapsed = time.perf_counter() - t0
+    transport.close()
+    p50, p99 = latency_stats(send_times, log.times)
+    return {
+        "rows": len(send_times),
+        "seconds": elapsed,
+        "p50_ms": p50,
+        "p99_ms": p99,
+        "complete": complete,
+        "broker": "rabbitmq" if opts["rabbit_url"] else "in-process",
+    }
+
+
+def run_report(opts):
+    import create_report
+    query, params = create_report.build_report_query()
+    conn = psycopg2.connect(**settings.config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM ({query}) q", params)
+            rows = cur.fetchone()[0]
+    finally:
+        conn.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        create_report.create_full_report(os.path.join(tmp, "report." + opts["report_format"]), fmt=opts["report_format"], use_cache=False)
+        return {"rows": rows, "seconds": time.perf_counter() - t0}
+
+
+def run_scenario(name, opts):
+    result = globals()["run_" + name](opts)
+    result["rows_per_sec"] = round(result["rows"] / result["seconds"], 1) if result["seconds"] else None
+    result["seconds"] = round(result["seconds"], 3)
+    result.setdefault("p50_ms", None)
+    result.setdefault("p99_ms", None)
+    # Linux reports ru_maxrss in KiB; each scenario runs in its own process
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        if previous.get("rows_per_sec") and current.get("rows_per_sec") is not None:
+            if current["rows_per_sec"] < previous["rows_per_sec"] * (1 - tolerance):
+                regressions.append(f"{name}: rows/sec {previous['rows_per_sec']} -> {current['rows_per_sec']}")
+        if previous.get("p99_ms") and current.get("p99_ms") is not None:
+            if current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+                regressions.append(f"{name}: p99 {previous['p99_ms']}ms -> {current['p99_ms']}ms")
+        if previous.get("peak_rss_kb") and current["peak_rss_kb"] > previous["peak_rss_kb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {previous['peak_rss_kb']}KiB -> {current['peak_rss_kb']}KiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the import, transport and report paths and write the results as JSON")
+    parser.add_argument("--sqlite", default=os.path.join(ROOT, "hospital_denormalized.db"),
+                        help="source database, e.g. one filled by benchmarks/generate_data.py")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--server", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--rabbit-url", help="use a real broker instead of the in-process stand-in")
+    parser.add_argument("--batch", action="store_true", help="enable the importer's micro-batching")
+    parser.add_argument("--batch-rows", type=int, default=500)
+    parser.add_argument("--dimension-cache", action="store_true")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--report-format", choices=("xlsx", "csv"), default="xlsx")
+    parser.add_argument("--timeout", type=float, default=3600)
+    args = parser.parse_args()
+
+    opts = vars(args)
+    opts["sqlite"] = os.path.abspath(args.sqlite)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for name in scenarios:
+        print(f"Running {name} ...")
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(run_scenario, (name, opts))
+        print(f"  {json.dumps(results[name], ensure_ascii=False)}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "source_rows": source_row_count(opts["sqlite"]),
+            "options": {k: v for k, v in opts.items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,31 @@
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
 import psycopg2
 from openpyxl import Workbook
 import settings
 
-def create_full_report(filename="report.xlsx", department=None, doctor=None, patient=None, appointment_date=None):
-    conn = psycopg2.connect(**settings.config)
-    cur = conn.cursor()
+REPORT_HEADER = ["Пациент", "Дата рождения", "Врач", "Специализация", "Отделение", "Дата приёма", "Жалобы"]
+SUMMARY_HEADER = ["День", "Разрез", "Значение", "Приёмов"]
+SUMMARY_VIEWS = ("report_daily_departments", "report_daily_doctors", "report_daily_diagnoses")
+
 
+REPORT_FROM = """
+        FROM appointments a
+        JOIN patients p ON a.patient_id=p.id
+        JOIN doctors d ON a.doctor_id=d.id
+        JOIN departments dep ON d.department_id=dep.id
+"""
+
+
+def build_report_query(department=None, doctor=None, patient=None, appointment_date=None, date_from=None, date_to=None):
     query = """
         SELECT p.full_name,
                TO_CHAR(p.birth_date,'YYYY-MM-DD'),
@@ -14,12 +34,16 @@ def create_full_report(filename="report.xlsx", department=None, doctor=None, pat
                dep.name,
                TO_CHAR(a.appointment_date,'YYYY-MM-DD HH24:MI'),
                a.complaints
-        FROM appointments a
-        JOIN patients p ON a.patient_id=p.id
-        JOIN doctors d ON a.doctor_id=d.id
-        JOIN departments dep ON d.department_id=dep.id
-    """
+    """ + REPORT_FROM
+    conditions, params = report_conditions(department, doctor, patient, appointment_date, date_from, date_to)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY a.appointment_date"
+    return query, params
+
 
+def report_conditions(department=None, doctor=None, patient=None, appointment_date=None, date_from=None, date_to=None):
     conditions = []
     params = []
 
@@ -33,32 +57,409 @@ def create_full_report(filename="report.xlsx", department=None, doctor=None, pat
         conditions.append("p.full_name = %s")
         params.append(patient)
     if appointment_date:
-        conditions.append("TO_CHAR(a.appointment_date,'YYYY-MM-DD') = %s")
-        params.append(appointment_date)
+        conditions.append("a.appointment_date >= %s::date AND a.appointment_date < %s::date + 1")
+        params.extend([appointment_date, appointment_date])
+    if date_from:
+        conditions.append("a.appointment_date >= %s::timestamp")
+        params.append(date_from)
+    if date_to:
+        conditions.append("a.appointment_date < %s::timestamp")
+        params.append(date_to)
+    return conditions, params
 
+
+def iter_report_rows(conn, query, params, itersize=5000):
+    # Server-side cursor: rows arrive in itersize chunks instead of one fetchall()
+    with conn.cursor(name="full_report") as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+
+
+def build_summary_query(date_from=None, date_to=None, day=None):
+    query = """
+        SELECT TO_CHAR(day,'YYYY-MM-DD'), kind, label, appointments FROM (
+            SELECT day, 'Отделение' AS kind, department_name AS label, appointments FROM report_daily_departments
+            UNION ALL
+            SELECT day, 'Врач', doctor_name || ' (' || COALESCE(specialization, '') || ')', appointments FROM report_daily_doctors
+            UNION ALL
+            SELECT day, 'Диагноз', diagnosis_name, appointments FROM report_daily_diagnoses
+        ) s
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("day >= %s::date")
+        params.append(date_from)
+    if date_to:
+        conditions.append("day < %s::date")
+        params.append(date_to)
+    if day:
+        conditions.append("day = %s::date")
+        params.append(day)
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY day, kind, label"
+    return query, params
 
-    query += " ORDER BY a.appointment_date;"
 
-    cur.execute(query, params)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
+def build_filtered_summary_query(department=None, doctor=None, patient=None, appointment_date=None, date_from=None,
+                                 date_to=None):
+    # The summary views cannot be narrowed to a department, doctor or patient: a filtered report
+    # aggregates its own rows with the joins and filters of build_report_query
+    conditions, params = report_conditions(department, doctor, patient, appointment_date, date_from, date_to)
+    where = " WHERE " + " AND ".join(["a.appointment_date IS NOT NULL"] + conditions)
+    query = f"""
+        SELECT TO_CHAR(day,'YYYY-MM-DD'), kind, label, appointments FROM (
+            SELECT a.appointment_date::date AS day, 'Отделение' AS kind, dep.name AS label, COUNT(*) AS appointments
+            {REPORT_FROM}{where}
+            GROUP BY 1, dep.id, dep.name
+            UNION ALL
+            SELECT a.appointment_date::date, 'Врач', d.full_name || ' (' || COALESCE(d.specialization, '') || ')', COUNT(*)
+            {REPORT_FROM}{where}
+            GROUP BY 1, d.id, d.full_name, d.specialization
+            UNION ALL
+            SELECT a.appointment_date::date, 'Диагноз', dg.name, COUNT(*)
+            {REPORT_FROM}
+            JOIN appointment_diagnoses ad ON ad.appointment_id = a.id
+            JOIN diagnoses dg ON dg.id = ad.diagnosis_id{where}
+            GROUP BY 1, dg.id, dg.name
+        ) s
+        ORDER BY day, kind, label
+    """
+    return query, params * 3
+
 
-    wb = Workbook()
-    ws = wb.active
-    ws.append(["Пациент","Дата рождения","Врач","Специализация","Отделение","Дата приёма","Жалобы"])
-    for row in data:
+def refresh_summaries(concurrently=True):
+    conn = psycopg2.connect(**settings.config)
+    try:
+        with conn.cursor() as cur:
+            for view in SUMMARY_VIEWS:
+                cur.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}{view}")
+        conn.commit()
+        # The summary sheet of cached reports comes from these views
+        with conn.cursor() as cur:
+            cur.execute("SELECT nextval('import_data_version')")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def append_sheet(wb, title, header, rows):
+    ws = wb.create_sheet(title)
+    ws.append(header)
+    for row in rows:
         ws.append(row)
+
+
+def write_xlsx(rows, filename, sheet_title="Отчёт", summary_rows=None):
+    wb = Workbook(write_only=True)
+    append_sheet(wb, sheet_title, REPORT_HEADER, rows)
+    if summary_rows is not None:
+        append_sheet(wb, "Сводка", SUMMARY_HEADER, summary_rows)
     wb.save(filename)
 
 
+def write_csv(rows, filename, header=REPORT_HEADER):
+    with open(filename, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def report_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return "csv" if filename.lower().endswith(".csv") else "xlsx"
+
+
+def normalize_filter(value, kind=None):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        if kind == "date":
+            return date.fromisoformat(value[:10]).isoformat()
+        if kind == "timestamp":
+            return datetime.fromisoformat(value).isoformat(sep=" ")
+    except ValueError:
+        pass
+    return value
+
+
+def read_data_version(conn):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT last_value, is_called FROM import_data_version")
+            last_value, is_called = cur.fetchone()
+        return last_value if is_called else 0
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Report cache disabled, no data version:", e)
+        return None
+
+
+class ReportCache:
+    # Finished report files on disk, least recently used evicted first. The key includes
+    # import_data_version, which writers bump after each commit, so new data is never served stale
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, filters, fmt, version):
+        payload = json.dumps({"filters": filters, "format": fmt, "version": version}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def fetch(self, key, fmt, filename):
+        path = self.path(key, fmt)
+        try:
+            shutil.copyfile(path, filename)
+        except FileNotFoundError:
+            return False
+        os.utime(path)
+        return True
+
+    def store(self, key, fmt, filename):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmp)
+            os.replace(tmp, self.path(key, fmt))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def report_cache():
+    rc = getattr(settings, "report_cache", {})
+    if not rc.get("enabled", False):
+        return None
+    return ReportCache(rc.get("dir", ".report_cache"), rc.get("max_bytes", 512 * 1024 * 1024))
+
+
+def create_full_report(filename="report.xlsx", department=None, doctor=None, patient=None, appointment_date=None,
+                       fmt=None, itersize=5000, date_from=None, date_to=None, include_summary=False, use_cache=True):
+    fmt = report_format(filename, fmt)
+    # Normalized once: the cache key and the query have to see the same filter values
+    filters = {
+        "department": normalize_filter(department),
+        "doctor": normalize_filter(doctor),
+        "patient": normalize_filter(patient),
+        "appointment_date": normalize_filter(appointment_date, "date"),
+        "date_from": normalize_filter(date_from, "timestamp"),
+        "date_to": normalize_filter(date_to, "timestamp"),
+    }
+    query, params = build_report_query(**filters)
+    cache = report_cache() if use_cache else None
+    cache_key = None
+    conn = psycopg2.connect(**settings.config)
+    try:
+        if cache is not None:
+            # Read before the report query: rows committed after this point can only raise the version
+            version = read_data_version(conn)
+            if version is not None:
+                key_filters = dict(filters, include_summary=bool(include_summary) and fmt == "xlsx")
+                cache_key = cache.key(key_filters, fmt, version)
+                if cache.fetch(cache_key, fmt, filename):
+                    print(f"Report served from cache (data version {version})")
+                    return
+        rows = iter_report_rows(conn, query, params, itersize)
+        if fmt == "csv":
+            write_csv(rows, filename)
+        else:
+            summary_rows = None
+            if include_summary:
+                if filters["department"] or filters["doctor"] or filters["patient"]:
+                    summary_query = build_filtered_summary_query(**filters)
+                else:
+                    # Served from the views: only as fresh as the last refresh_summaries run
+                    summary_query = build_summary_query(filters["date_from"], filters["date_to"], filters["appointment_date"])
+                with conn.cursor() as cur:
+                    cur.execute(*summary_query)
+                    summary_rows = cur.fetchall()
+            write_xlsx(rows, filename, summary_rows=summary_rows)
+    finally:
+        conn.close()
+    if cache_key is not None:
+        cache.store(cache_key, fmt, filename)
+
+
+def create_summary_report(filename="summary.xlsx", date_from=None, date_to=None, fmt=None):
+    query, params = build_summary_query(date_from, date_to)
+    conn = psycopg2.connect(**settings.config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    if report_format(filename, fmt) == "csv":
+        write_csv(rows, filename, SUMMARY_HEADER)
+    else:
+        wb = Workbook(write_only=True)
+        append_sheet(wb, "Сводка", SUMMARY_HEADER, rows)
+        wb.save(filename)
+
+
+def split_date_range(date_from, date_to, slice_by="month"):
+    start = date.fromisoformat(str(date_from)[:10])
+    end = date.fromisoformat(str(date_to)[:10])
+    slices = []
+    current = start
+    while current < end:
+        if slice_by == "week":
+            following = current + timedelta(days=7 - current.weekday())
+        else:
+            following = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        following = min(following, end)
+        slices.append((current, following))
+        current = following
+    return slices
+
+
+_slice_conn = None
+
+
+def _open_slice_connection():
+    global _slice_conn
+    _slice_conn = psycopg2.connect(**settings.config)
+
+
+def export_slice(part_path, fmt, filters, start, end, itersize):
+    # Runs in a worker process; each worker keeps one connection for all of its slices
+    query, params = build_report_query(**filters, date_from=start.isoformat(), date_to=end.isoformat())
+    try:
+        rows = iter_report_rows(_slice_conn, query, params, itersize)
+        if fmt == "csv":
+            write_csv(rows, part_path)
+        else:
+            write_xlsx(rows, part_path, sheet_title=start.strftime("%Y-%m-%d"))
+    finally:
+        _slice_conn.rollback()
+    return part_path
+
+
+def create_parallel_report(filename, date_from, date_to, slice_by="month", workers=4, fmt=None, layout="parts",
+                           department=None, doctor=None, patient=None, itersize=5000):
+    fmt = report_format(filename, fmt)
+    if layout == "sheets" and fmt != "xlsx":
+        raise ValueError("layout='sheets' needs XLSX output")
+    slices = split_date_range(date_from, date_to, slice_by)
+    filters = {"department": department, "doctor": doctor, "patient": patient}
+    stem, ext = os.path.splitext(filename)
+    tmp_dir = tempfile.mkdtemp(prefix="report_parts_") if layout == "sheets" else None
+    part_paths = []
+    for i, (start, _) in enumerate(slices):
+        if tmp_dir:
+            part_paths.append(os.path.join(tmp_dir, f"{i:04d}.csv"))
+        else:
+            part_paths.append(f"{stem}.part{i:04d}_{start.isoformat()}{ext or '.' + fmt}")
+    part_fmt = "csv" if tmp_dir else fmt
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_open_slice_connection) as pool:
+        futures = [
+            pool.submit(export_slice, part_paths[i], part_fmt, filters, start, end, itersize)
+            for i, (start, end) in enumerate(slices)
+        ]
+        for future in futures:
+            future.result()
+
+    if not tmp_dir:
+        return part_paths
+
+    # Parts were written concurrently; they are appended to the workbook in slice order
+    wb = Workbook(write_only=True)
+    try:
+        for (start, _), part_path in zip(slices, part_paths):
+            with open(part_path, newline="", encoding="utf-8-sig") as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                append_sheet(wb, start.strftime("%Y-%m-%d"), REPORT_HEADER, reader)
+        wb.save(filename)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        os.rmdir(tmp_dir)
+    return [filename]
+
+
 if __name__ == "__main__":
-    create_full_report(
-        filename="report_filtered.xlsx",
-        department="Терапевтическое отделение",
-        doctor="Сидоров Сергей Петрович",
-        patient="Иванов Иван Иванович",
-        appointment_date="2025-09-11"
-    )
+    parser = argparse.ArgumentParser(description="Build a report of appointments from the normalized DB")
+    parser.add_argument("--output", default="report_filtered.xlsx")
+    parser.add_argument("--format", choices=("xlsx", "csv"), default=None)
+    parser.add_argument("--department")
+    parser.add_argument("--doctor")
+    parser.add_argument("--patient")
+    parser.add_argument("--appointment-date")
+    parser.add_argument("--date-from", help="inclusive lower bound, e.g. 2025-09-01")
+    parser.add_argument("--date-to", help="exclusive upper bound, e.g. 2025-10-01")
+    parser.add_argument("--itersize", type=int, default=5000)
+    parser.add_argument("--summary", action="store_true",
+                        help="add the per-day summary sheet to the XLSX report; without department/doctor/patient "
+                             "filters it comes from the summary views and is only as fresh as the last --refresh-summaries")
+    parser.add_argument("--summary-only", action="store_true",
+                        help="write only the per-day summary from the summary views, as of the last --refresh-summaries")
+    parser.add_argument("--refresh-summaries", action="store_true",
+                        help="refresh the summary views and exit; nothing refreshes them automatically")
+    parser.add_argument("--parallel", type=int, default=0, help="export date slices with this many worker processes")
+    parser.add_argument("--slice", choices=("month", "week"), default="month")
+    parser.add_argument("--layout", choices=("parts", "sheets"), default="parts")
+    parser.add_argument("--no-cache", action="store_true", help="always rebuild the report, bypassing the report cache")
+    args = parser.parse_args()
+    if args.refresh_summaries:
+        refresh_summaries()
+    elif args.parallel:
+        if not (args.date_from and args.date_to):
+            parser.error("--parallel needs --date-from and --date-to")
+        paths = create_parallel_report(
+            args.output, args.date_from, args.date_to, args.slice, args.parallel, args.format, args.layout,
+            args.department, args.doctor, args.patient, args.itersize
+        )
+        print("\n".join(paths))
+    elif args.summary_only:
+        create_summary_report(args.output, args.date_from, args.date_to, args.format)
+    else:
+        create_full_report(
+            filename=args.output,
+            department=args.department,
+            doctor=args.doctor,
+            patient=args.patient,
+            appointment_date=args.appointment_date,
+            fmt=args.format,
+            itersize=args.itersize,
+            date_from=args.date_from,
+            date_to=args.date_to,
+            include_summary=args.summary,
+            use_cache=not args.no_cache
+        )
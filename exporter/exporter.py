@@ -3,15 +3,40 @@ import json
 import socket
 import ssl
 import base64
+import hashlib
+import itertools
+import multiprocessing
+import queue
+import select
 import sqlite3
+import struct
+import threading
 import time
 import os
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
 import yaml
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 import pika
+import pika.exceptions
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Must match the importer: magic, version, header length, then JSON stream header;
+# each frame is (kind, body length) + body
+STREAM_MAGIC = b"PSUB"
+STREAM_VERSION = 1
+STREAM_PREFIX = struct.Struct(">4sBH")
+FRAME_HEADER = struct.Struct(">BI")
+FRAME_ROWS = 1
+FRAME_HANDSHAKE = 2
 
 def load_config(path="config.yaml"):
     with open(path, "r", encoding="utf-8") as f:
@@ -22,6 +47,15 @@ def load_rsa_pubkey(path):
         data = f.read()
         return serialization.load_pem_public_key(data)
 
+_pubkey_cache = {}
+
+def get_rsa_pubkey(path):
+    pubkey = _pubkey_cache.get(path)
+    if pubkey is None:
+        pubkey = load_rsa_pubkey(path)
+        _pubkey_cache[path] = pubkey
+    return pubkey
+
 def rsa_encrypt(pubkey, plaintext: bytes) -> bytes:
     return pubkey.encrypt(
         plaintext,
@@ -37,7 +71,7 @@ def encrypt_custom(pubkey_path, plaintext_bytes: bytes):
     aesgcm = AESGCM(aes_key)
     iv = os.urandom(12)
     ct = aesgcm.encrypt(iv, plaintext_bytes, None)
-    pubkey = load_rsa_pubkey(pubkey_path)
+    pubkey = get_rsa_pubkey(pubkey_path)
     enc_key = rsa_encrypt(pubkey, aes_key)
     return {
         "encrypted_key_b64": base64.b64encode(enc_key).decode(),
@@ -45,39 +79,315 @@ def encrypt_custom(pubkey_path, plaintext_bytes: bytes):
         "ciphertext_b64": base64.b64encode(ct).decode()
     }
 
-def send_via_socket(host, port, message_bytes, config):
-    use_tls = config.get("use_tls", False)
-    sock = socket.create_connection((host, port), timeout=10)
-    if use_tls:
-        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        ca_cert = config.get("tls", {}).get("ca_cert")
-        if ca_cert:
-            context.load_verify_locations(cafile=ca_cert)
-        context.check_hostname = True
-        context.verify_mode = ssl.CERT_REQUIRED
-        wrapped = context.wrap_socket(sock, server_hostname=host)
-        conn = wrapped
-    else:
-        conn = sock
+def session_encrypt(aesgcm, key_id, seq, plaintext_bytes: bytes):
+    nonce = seq.to_bytes(12, "big")
+    ct = aesgcm.encrypt(nonce, plaintext_bytes, key_id.encode("ascii"))
+    return {
+        "key_id": key_id,
+        "seq": seq,
+        "ciphertext_b64": base64.b64encode(ct).decode()
+    }
 
-    conn.sendall(message_bytes + b"\n")
-    conn.close()
+def session_seal(aesgcm, key_id, seq, plaintext_bytes: bytes):
+    # Binary counterpart of session_encrypt: raw key id digest, 8-byte seq, ciphertext
+    ct = aesgcm.encrypt(seq.to_bytes(12, "big"), plaintext_bytes, key_id.encode("ascii"))
+    return bytes.fromhex(key_id) + seq.to_bytes(8, "big") + ct
 
-def publish_rabbitmq(url, queue, message_bytes, config):
-    params = pika.URLParameters(url)
-    if config.get("rabbitmq", {}).get("use_tls"):
-        pass
-
-    connection = pika.BlockingConnection(params)
-    channel = connection.channel()
-    channel.queue_declare(queue=queue, durable=True)
-    channel.basic_publish(
-        exchange='',
-        routing_key=queue,
-        body=message_bytes,
-        properties=pika.BasicProperties(delivery_mode=2)  # persistent
-    )
-    connection.close()
+class SessionEncryptor:
+    MAX_MESSAGES_PER_KEY = 2 ** 32
+
+    def __init__(self, pubkey, rekey_every=0):
+        self.pubkey = pubkey
+        self.rekey_every = rekey_every
+        self.aes_key = None
+        self.aesgcm = None
+        self.key_id = None
+        self.counter = 0
+
+    def needs_handshake(self, n=1):
+        if self.aesgcm is None or self.counter + n > self.MAX_MESSAGES_PER_KEY:
+            return True
+        return bool(self.rekey_every) and self.counter + n > self.rekey_every
+
+    def rekey(self):
+        self.aes_key = AESGCM.generate_key(bit_length=256)
+        enc_key_b64 = base64.b64encode(rsa_encrypt(self.pubkey, self.aes_key)).decode()
+        self.key_id = hashlib.sha256(enc_key_b64.encode("ascii")).hexdigest()
+        self.aesgcm = AESGCM(self.aes_key)
+        self.counter = 0
+        return {"key_id": self.key_id, "encrypted_key_b64": enc_key_b64}
+
+    def reserve(self, n):
+        # Hands a contiguous nonce range to an encode worker so parallel chunks never reuse a nonce
+        start = self.counter
+        self.counter += n
+        return self.key_id, self.aes_key, start
+
+    def encrypt(self, plaintext_bytes: bytes):
+        seq = self.counter
+        self.counter += 1
+        return session_encrypt(self.aesgcm, self.key_id, seq, plaintext_bytes)
+
+    def seal(self, plaintext_bytes: bytes):
+        seq = self.counter
+        self.counter += 1
+        return session_seal(self.aesgcm, self.key_id, seq, plaintext_bytes)
+
+class SocketTransport:
+    def __init__(self, host, port, config):
+        self.host = host
+        self.port = port
+        self.context = None
+        if config.get("use_tls", False):
+            self.context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            ca_cert = config.get("tls", {}).get("ca_cert")
+            if ca_cert:
+                self.context.load_verify_locations(cafile=ca_cert)
+            self.context.check_hostname = True
+            self.context.verify_mode = ssl.CERT_REQUIRED
+        rc = config.get("reconnect", {})
+        self.max_retries = rc.get("max_retries", 10)
+        self.initial_backoff = rc.get("initial_backoff_sec", 0.5)
+        self.max_backoff = rc.get("max_backoff_sec", 30)
+        self.max_in_flight_bytes = config.get("flow_control", {}).get("max_in_flight_bytes", 1 << 20)
+        self.outbuf = bytearray()
+        self.head_sent = 0
+        # (size, is handshake) per message still in outbuf
+        self.markers = deque()
+        self.delimiter = b"\n"
+        self.stream_header = None
+        # Last session handshake that left outbuf: the key everything still in outbuf starts with
+        self.handshake = None
+        self.conn = None
+        self.tls_session = None
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+        if self.context is not None:
+            sock = self.context.wrap_socket(sock, server_hostname=self.host, session=self.tls_session)
+            self.tls_session = sock.session
+        if self.stream_header is not None:
+            sock.sendall(self.stream_header)
+        if self.handshake is not None:
+            # outbuf is replayed from its start, so a restarted importer must learn that key first
+            sock.sendall(self.handshake + self.delimiter)
+        self.conn = sock
+        print(f"Connected to {self.host}:{self.port} (tls={self.context is not None})")
+
+    def _retry(self, action):
+        attempt = 0
+        while True:
+            try:
+                if self.conn is None:
+                    self.connect()
+                return action()
+            except OSError as e:
+                self.drop()
+                self.head_sent = 0
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+                print(f"Socket send failed ({e}), reconnecting in {delay:.1f}s")
+                time.sleep(delay)
+
+    def pump(self, limit=None):
+        # Without a limit only writes what the socket accepts right now; with one, blocks until the buffer drains to it
+        while len(self.outbuf) > self.head_sent:
+            if limit is not None and len(self.outbuf) <= limit:
+                return
+            _, writable, _ = select.select([], [self.conn], [], None if limit is not None else 0)
+            if not writable:
+                return
+            n = self.conn.send(bytes(self.outbuf[self.head_sent:self.head_sent + 65536]))
+            self.head_sent += n
+            done = 0
+            while self.markers and done + self.markers[0][0] <= self.head_sent:
+                size, handshake = self.markers.popleft()
+                done += size
+                if handshake:
+                    self.handshake = bytes(self.outbuf[done - size:done - len(self.delimiter)])
+            if done:
+                del self.outbuf[:done]
+                self.head_sent -= done
+
+    def send(self, message_bytes, marker=None, handshake=False):
+        self.outbuf += message_bytes
+        self.outbuf += self.delimiter
+        self.markers.append((len(message_bytes) + len(self.delimiter), handshake))
+        limit = self.max_in_flight_bytes if len(self.outbuf) > self.max_in_flight_bytes else None
+        self._retry(lambda: self.pump(limit))
+
+    def in_flight(self):
+        return len(self.markers)
+
+    def flush(self):
+        self._retry(lambda: self.pump(0))
+
+    def drop(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+            self.conn = None
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.drop()
+
+class RabbitTransport:
+    def __init__(self, url, queue, config):
+        self.url = url
+        self.queue = queue
+        rc = config.get("rabbitmq", {})
+        self.confirm_batch = max(1, min(rc.get("confirm_batch", 500), config.get("flow_control", {}).get("max_in_flight", 1000)))
+        self.max_retries = config.get("reconnect", {}).get("max_retries", 10)
+        self.initial_backoff = config.get("reconnect", {}).get("initial_backoff_sec", 0.5)
+        self.max_backoff = config.get("reconnect", {}).get("max_backoff_sec", 30)
+        self.connection = None
+        self.channel = None
+        self.unconfirmed = []
+        self.confirmed_marker = None
+        self.stream_header = None
+
+    def connect(self):
+        self.connection = pika.BlockingConnection(pika.URLParameters(self.url))
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=self.queue, durable=True)
+        if self.confirm_batch > 1:
+            self.channel.tx_select()
+        else:
+            self.channel.confirm_delivery()
+
+    def _publish(self, message_bytes):
+        # Binary frames travel as self-contained bodies: each one repeats the short stream header
+        if self.stream_header is not None:
+            message_bytes = self.stream_header + message_bytes
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=self.queue,
+            body=message_bytes,
+            properties=pika.BasicProperties(delivery_mode=2)  # persistent
+        )
+
+    def _retry(self, action):
+        attempt = 0
+        while True:
+            try:
+                if self.channel is None:
+                    self.connect()
+                    for message_bytes, _ in self.unconfirmed:
+                        self._publish(message_bytes)
+                return action()
+            except pika.exceptions.AMQPError as e:
+                self.drop()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+                print(f"RabbitMQ publish failed ({e!r}), reconnecting in {delay:.1f}s")
+                time.sleep(delay)
+
+    def send(self, message_bytes, marker=None, handshake=False):
+        # handshake is unused: custom_session is refused in rabbitmq mode (see make_encode_context)
+        self._retry(lambda: self._publish(message_bytes))
+        if self.confirm_batch == 1:
+            if marker is not None:
+                self.confirmed_marker = marker
+            return
+        self.unconfirmed.append((message_bytes, marker))
+        if len(self.unconfirmed) >= self.confirm_batch:
+            self.flush()
+
+    def in_flight(self):
+        return len(self.unconfirmed)
+
+    def flush(self):
+        if not self.unconfirmed:
+            return
+        self._retry(lambda: self.channel.tx_commit())
+        for _, marker in self.unconfirmed:
+            if marker is not None:
+                self.confirmed_marker = marker
+        self.unconfirmed = []
+
+    def drop(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+        self.connection = None
+        self.channel = None
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.drop()
+
+class TokenBucket:
+    def __init__(self, rate, burst_sec=1.0):
+        self.rate = rate
+        self.capacity = max(rate * burst_sec, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def acquire(self, amount=1):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            need = min(amount, self.capacity)
+            if self.tokens >= need:
+                self.tokens -= amount
+                return
+            time.sleep((need - self.tokens) / self.rate)
+
+class ThroughputReporter:
+    def __init__(self, every_sec):
+        self.every_sec = every_sec
+        self.started = self.window_start = time.monotonic()
+        self.rows = self.bytes = 0
+        self.window_rows = self.window_bytes = 0
+
+    def record(self, nbytes, transport, rows=1):
+        self.rows += rows
+        self.bytes += nbytes
+        self.window_rows += rows
+        self.window_bytes += nbytes
+        if not self.every_sec:
+            return
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= self.every_sec:
+            print(f"Sent {self.rows} rows: {self.window_rows / elapsed:.0f} rows/s, "
+                  f"{self.window_bytes / elapsed / 1024:.0f} KiB/s, in flight {transport.in_flight()}")
+            self.window_start = now
+            self.window_rows = self.window_bytes = 0
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        print(f"Done: {self.rows} rows in {elapsed:.1f}s ({self.rows / elapsed:.0f} rows/s, {self.bytes / elapsed / 1024:.0f} KiB/s)")
+
+def build_transport(cfg):
+    mode = cfg.get("mode", "socket")
+    if mode == "socket":
+        host = cfg.get("socket", {}).get("host", "127.0.0.1")
+        port = cfg.get("socket", {}).get("port", 9000)
+        return SocketTransport(host, port, cfg)
+    if mode == "rabbitmq":
+        rabbit_url = cfg.get("rabbitmq", {}).get("url")
+        rabbit_queue = cfg.get("rabbitmq", {}).get("queue", "psu_lab_queue")
+        if not rabbit_url:
+            raise RuntimeError("RabbitMQ URL not configured")
+        return RabbitTransport(rabbit_url, rabbit_queue, cfg)
+    raise RuntimeError("Unknown mode: %s" % mode)
 
 def iter_rows_from_sqlite(path, table):
     conn = sqlite3.connect(path)
@@ -88,53 +398,407 @@ def iter_rows_from_sqlite(path, table):
         yield dict(row)
     conn.close()
 
+def iter_rows_by_rowid(path, table, after_rowid=0, page_size=1000):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    last_rowid = after_rowid
+    try:
+        while True:
+            page = conn.execute(
+                f"SELECT rowid AS _rowid, * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, page_size)
+            ).fetchall()
+            if not page:
+                return
+            for r in page:
+                row = dict(r)
+                last_rowid = row.pop("_rowid")
+                yield last_rowid, row
+    finally:
+        conn.close()
+
+def checkpoint_path_for(cfg, sqlite_path, table):
+    return cfg.get("incremental", {}).get("checkpoint_file") or f"{sqlite_path}.{table}.checkpoint.json"
+
+def load_checkpoint(path, sqlite_path, table):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if state.get("sqlite") != os.path.abspath(sqlite_path) or state.get("table") != table:
+        raise RuntimeError(f"Checkpoint {path} belongs to {state.get('sqlite')}:{state.get('table')}")
+    return int(state.get("last_rowid", 0))
+
+def save_checkpoint(path, sqlite_path, table, last_rowid):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"sqlite": os.path.abspath(sqlite_path), "table": table, "last_rowid": last_rowid}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def fingerprint_path_for(cfg, sqlite_path, table):
+    return cfg.get("sync", {}).get("index_file") or f"{sqlite_path}.{table}.fingerprints.db"
+
+def row_fingerprint(row):
+    canonical = json.dumps(row, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+class FingerprintIndex:
+    # Sidecar SQLite file with one hash per source rowid. Hashes of sent rows are held in
+    # pending until the transport confirms them, so an interrupted sync resends instead of skipping
+    def __init__(self, path, sqlite_path, table):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fingerprints (row_id INTEGER PRIMARY KEY, hash BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS source (sqlite TEXT NOT NULL, source_table TEXT NOT NULL)")
+        source = (os.path.abspath(sqlite_path), table)
+        stored = self.conn.execute("SELECT sqlite, source_table FROM source").fetchone()
+        if stored is None:
+            self.conn.execute("INSERT INTO source VALUES (?, ?)", source)
+        elif tuple(stored) != source:
+            raise RuntimeError(f"Fingerprint index {path} belongs to {stored[0]}:{stored[1]}")
+        self.conn.commit()
+        self.pending = OrderedDict()
+        self.counts = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0}
+
+    def lookup(self, after_rowid, last_rowid):
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT row_id, hash FROM fingerprints WHERE row_id > ? AND row_id <= ?", (after_rowid, last_rowid)
+            ))
+
+    def forget(self, rowids):
+        if not rowids:
+            return
+        with self.lock:
+            self.conn.executemany("DELETE FROM fingerprints WHERE row_id = ?", [(r,) for r in rowids])
+            self.conn.commit()
+            self.counts["deleted"] += len(rowids)
+
+    def forget_after(self, rowid):
+        with self.lock:
+            cur = self.conn.execute("DELETE FROM fingerprints WHERE row_id > ?", (rowid,))
+            self.conn.commit()
+            self.counts["deleted"] += cur.rowcount
+
+    def add_pending(self, rowid, fingerprint, changed):
+        with self.lock:
+            self.pending[rowid] = fingerprint
+            self.counts["changed" if changed else "new"] += 1
+
+    def fingerprint_of(self, rowid):
+        with self.lock:
+            fingerprint = self.pending.get(rowid)
+        return fingerprint.hex() if fingerprint is not None else None
+
+    def confirm(self, up_to_rowid):
+        with self.lock:
+            done = []
+            while self.pending:
+                rowid = next(iter(self.pending))
+                if rowid > up_to_rowid:
+                    break
+                done.append((rowid, self.pending.pop(rowid)))
+            self.conn.executemany("INSERT OR REPLACE INTO fingerprints (row_id, hash) VALUES (?, ?)", done)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def iter_changed_rows(path, table, index, page_size=1000):
+    # Streams the source in rowid order and compares each page with the stored hashes of the same rowid range
+    last_rowid = 0
+    for page in iter_row_chunks(iter_rows_by_rowid(path, table, 0, page_size), page_size):
+        stored = index.lookup(last_rowid, page[-1][0])
+        for rowid, row in page:
+            fingerprint = row_fingerprint(row)
+            previous = stored.pop(rowid, None)
+            if previous == fingerprint:
+                index.counts["unchanged"] += 1
+                continue
+            index.add_pending(rowid, fingerprint, previous is not None)
+            yield rowid, row
+        index.forget(list(stored))
+        last_rowid = page[-1][0]
+    index.forget_after(last_rowid)
+
+def iter_row_chunks(rows, chunk_rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def make_encode_context(cfg, source_table):
+    use_custom = cfg.get("use_custom_crypto", False)
+    if use_custom:
+        scheme = cfg.get("crypto", {}).get("scheme", "custom")
+    else:
+        scheme = "tls" if cfg.get("use_tls", False) else "plain"
+    fr = cfg.get("framing", {})
+    ctx = {
+        "scheme": scheme,
+        "source_table": source_table,
+        "pubkey_path": cfg.get("crypto", {}).get("importer_pubkey_path"),
+        "framing": fr.get("format", "json"),
+        "frame_rows": max(1, fr.get("batch_rows", 100)),
+        "compression": fr.get("compression", "none"),
+        "compression_level": fr.get("compression_level", 3)
+    }
+    if scheme == "custom_session" and cfg.get("mode", "socket") == "rabbitmq":
+        # The importer cannot share a handshake between queue consumers or keep it across restarts
+        raise RuntimeError("crypto.scheme custom_session works only in socket mode; use custom or TLS with RabbitMQ")
+    if ctx["framing"] == "binary":
+        if scheme == "custom":
+            raise RuntimeError("Binary framing needs crypto.scheme: custom_session (or no custom crypto)")
+        if ctx["compression"] == "zstd" and zstandard is None:
+            raise RuntimeError("framing.compression is zstd but the zstandard module is not installed")
+    else:
+        ctx["frame_rows"] = 1
+    return ctx
+
+def stream_header(ctx):
+    header = json.dumps({
+        "source_table": ctx["source_table"],
+        "scheme": ctx["scheme"],
+        "compression": ctx["compression"]
+    }).encode("utf-8")
+    return STREAM_PREFIX.pack(STREAM_MAGIC, STREAM_VERSION, len(header)) + header
+
+def compress(body, ctx):
+    if ctx["compression"] == "zlib":
+        return zlib.compress(body, ctx["compression_level"])
+    if ctx["compression"] == "zstd":
+        return zstandard.ZstdCompressor(level=ctx["compression_level"]).compress(body)
+    return body
+
+def build_frame(rows, ctx, session_seal_fn=None):
+    body = compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), ctx)
+    if ctx["scheme"] == "custom_session":
+        body = session_seal_fn(body)
+    return FRAME_HEADER.pack(FRAME_ROWS, len(body)) + body
+
+def handshake_message(ctx, session):
+    if ctx["framing"] == "binary":
+        body = json.dumps(session.rekey()).encode("utf-8")
+        return FRAME_HEADER.pack(FRAME_HANDSHAKE, len(body)) + body
+    return json.dumps({
+        "scheme": "custom_session",
+        "type": "handshake",
+        "payload": session.rekey(),
+        "meta": {"source_table": ctx["source_table"]}
+    }, ensure_ascii=False).encode("utf-8")
+
+def build_message(row, ctx, session_encrypt_fn=None, fingerprint=None):
+    plaintext = json.dumps(row, ensure_ascii=False).encode("utf-8")
+    meta = {"source_table": ctx["source_table"]}
+    if fingerprint is not None:
+        meta["fingerprint"] = fingerprint
+    if ctx["scheme"] == "custom_session":
+        message = {"scheme": "custom_session", "payload": session_encrypt_fn(plaintext), "meta": meta}
+    elif ctx["scheme"] == "custom":
+        message = {"scheme": "custom", "payload": encrypt_custom(ctx["pubkey_path"], plaintext), "meta": meta}
+    else:
+        message = {
+            "scheme": ctx["scheme"],
+            "payload": {"plaintext_b64": base64.b64encode(plaintext).decode()},
+            "meta": meta
+        }
+    return json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+def encode_chunk(rows, ctx, reservation=None, fingerprints=None):
+    # Returns (rows covered, encoded bytes) pairs: one per row for JSON, one per frame for binary
+    encrypt_fn = None
+    if reservation is not None:
+        key_id, aes_key, start = reservation
+        aesgcm = AESGCM(aes_key)
+        seqs = itertools.count(start)
+        seal = session_seal if ctx["framing"] == "binary" else session_encrypt
+        encrypt_fn = lambda plaintext: seal(aesgcm, key_id, next(seqs), plaintext)
+    if ctx["framing"] == "binary":
+        n = ctx["frame_rows"]
+        return [(len(rows[i:i + n]), build_frame(rows[i:i + n], ctx, encrypt_fn)) for i in range(0, len(rows), n)]
+    fingerprints = fingerprints or [None] * len(rows)
+    return [(1, build_message(row, ctx, encrypt_fn, fp)) for row, fp in zip(rows, fingerprints)]
+
+def iter_encoded_parallel(rows, ctx, session, send_handshake, workers, chunk_rows, ordered=True, fingerprint_of=None):
+    chunks = queue.Queue(maxsize=workers * 2)
+    reader_error = []
+
+    def read_chunks():
+        try:
+            for chunk in iter_row_chunks(rows, chunk_rows):
+                chunks.put(chunk)
+        except Exception as e:
+            reader_error.append(e)
+        finally:
+            chunks.put(None)
+
+    threading.Thread(target=read_chunks, daemon=True).start()
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            markers = [marker for marker, _ in chunk]
+            chunk = [row for _, row in chunk]
+            reservation = None
+            if session is not None:
+                if session.needs_handshake(len(chunk)):
+                    # Chunks sealed with the old key go out first, so the stream never switches back
+                    # to a key whose handshake came earlier than the one in force
+                    while pending:
+                        yield take_completed(pending, ordered)
+                    send_handshake()
+                reservation = session.reserve(len(chunk))
+            fingerprints = [fingerprint_of(marker) for marker in markers] if fingerprint_of is not None else None
+            pending.append((pool.submit(encode_chunk, chunk, ctx, reservation, fingerprints), markers))
+            while len(pending) >= workers * 2:
+                yield take_completed(pending, ordered)
+        while pending:
+            yield take_completed(pending, ordered)
+    if reader_error:
+        raise reader_error[0]
+
+def take_completed(pending, ordered):
+    if ordered:
+        future, markers = pending.popleft()
+    else:
+        done, _ = wait([future for future, _ in pending], return_when=FIRST_COMPLETED)
+        future, markers = next(item for item in pending if item[0] in done)
+        pending.remove((future, markers))
+    encoded = []
+    pos = 0
+    for n, message_bytes in future.result():
+        pos += n
+        encoded.append((markers[pos - 1], message_bytes, n))
+    return encoded
+
 def main():
     parser = argparse.ArgumentParser(description="Exporter: send denormalized rows to importer")
     parser.add_argument("--config", default="config.yaml")
     parser.add_argument("--source-table", default="hospital_records")
     parser.add_argument("--sqlite", default="hospital_denormalized.db")
+    parser.add_argument("--workers", type=int, default=None, help="encode/encrypt in a process pool of this size")
+    parser.add_argument("--chunk-rows", type=int, default=None)
+    parser.add_argument("--unordered", action="store_true", help="send chunks as soon as they are encoded")
+    parser.add_argument("--incremental", action="store_true", help="send only rows after the persisted rowid checkpoint")
+    parser.add_argument("--sync", action="store_true", help="send only rows that are new or changed since the last sync")
     args = parser.parse_args()
     cfg = load_config(args.config)
 
-    mode = cfg.get("mode", "socket")
-    host = cfg.get("socket", {}).get("host", "127.0.0.1")
-    port = cfg.get("socket", {}).get("port", 9000)
-    rabbit_url = cfg.get("rabbitmq", {}).get("url")
-    rabbit_queue = cfg.get("rabbitmq", {}).get("queue", "psu_lab_queue")
+    ctx = make_encode_context(cfg, args.source_table)
+    pc = cfg.get("pipeline", {})
+    workers = args.workers if args.workers is not None else pc.get("workers", 0)
+    chunk_rows = args.chunk_rows or pc.get("chunk_rows", 500)
+    ordered = pc.get("ordered", True) and not args.unordered
+    ic = cfg.get("incremental", {})
+    incremental = args.incremental or ic.get("enabled", False)
+    sc = cfg.get("sync", {})
+    sync = args.sync or sc.get("enabled", False)
+    if (incremental or sync) and cfg.get("mode", "socket") != "rabbitmq":
+        # Only the broker confirms that a message is stored. Over a socket, rows still buffered in
+        # the importer when it crashes would be behind the checkpoint and never sent again
+        raise RuntimeError("Incremental and sync modes need mode: rabbitmq, where the broker confirms every message")
+    if (incremental or sync) and not ordered:
+        print("Incremental and sync modes need ordered delivery for their checkpoint, ignoring --unordered")
+        ordered = True
 
-    use_custom = cfg.get("use_custom_crypto", False)
-    rsa_pub = cfg.get("crypto", {}).get("importer_pubkey_path")
-
-    use_tls = cfg.get("use_tls", False)
-
-    for row in iter_rows_from_sqlite(args.sqlite, args.source_table):
-        plaintext = json.dumps(row, ensure_ascii=False).encode("utf-8")
-        if use_custom:
-            payload = encrypt_custom(rsa_pub, plaintext)
-            message = {
-                "scheme": "custom",
-                "payload": payload,
-                "meta": {"source_table": args.source_table}
-            }
-        else:
-            message = {
-                "scheme": "tls" if use_tls else "plain",
-                "payload": {"plaintext_b64": base64.b64encode(plaintext).decode()},
-                "meta": {"source_table": args.source_table}
-            }
-        message_bytes = json.dumps(message, ensure_ascii=False).encode("utf-8")
-
-        if mode == "socket":
-            print(host, port)
-            send_via_socket(host, port, message_bytes, cfg)
-        elif mode == "rabbitmq":
-            if not rabbit_url:
-                raise RuntimeError("RabbitMQ URL not configured")
-            publish_rabbitmq(rabbit_url, rabbit_queue, message_bytes, cfg)
-        else:
-            raise RuntimeError("Unknown mode: %s" % mode)
+    session = None
+    if ctx["scheme"] == "custom_session":
+        session = SessionEncryptor(get_rsa_pubkey(ctx["pubkey_path"]), cfg.get("crypto", {}).get("rekey_every", 100000))
+
+    transport = build_transport(cfg)
+    if ctx["framing"] == "binary":
+        transport.stream_header = stream_header(ctx)
+        transport.delimiter = b""
+
+    fc = cfg.get("flow_control")
+    legacy_interval = cfg.get("send_interval_sec", 0.1) if fc is None else 0
+    fc = fc or {}
+    row_bucket = TokenBucket(fc.get("rate_rows_per_sec", 0), fc.get("burst_sec", 1.0))
+    byte_bucket = TokenBucket(fc.get("rate_bytes_per_sec", 0), fc.get("burst_sec", 1.0))
+    reporter = ThroughputReporter(fc.get("report_every_sec", 5))
+
+    def send_handshake():
+        message_bytes = handshake_message(ctx, session)
+        byte_bucket.acquire(len(message_bytes))
+        transport.send(message_bytes, handshake=True)
 
-        time.sleep(cfg.get("send_interval_sec", 0.1))
+    checkpoint = {"path": None, "saved": None, "at": time.monotonic()}
+    checkpoint_every = ic.get("checkpoint_every_sec", 5)
+    index = None
+    fingerprint_of = None
+    if sync:
+        index = FingerprintIndex(fingerprint_path_for(cfg, args.sqlite, args.source_table), args.sqlite, args.source_table)
+        checkpoint_every = sc.get("checkpoint_every_sec", 5)
+        if ctx["framing"] == "json":
+            fingerprint_of = index.fingerprint_of
+        print("Sync export: sending new and changed rows")
+        rows = iter_changed_rows(args.sqlite, args.source_table, index, sc.get("page_size", 1000))
+    elif incremental:
+        checkpoint["path"] = checkpoint_path_for(cfg, args.sqlite, args.source_table)
+        checkpoint["saved"] = load_checkpoint(checkpoint["path"], args.sqlite, args.source_table)
+        print(f"Incremental export from rowid > {checkpoint['saved']}")
+        rows = iter_rows_by_rowid(args.sqlite, args.source_table, checkpoint["saved"], ic.get("page_size", 1000))
+    else:
+        rows = ((None, row) for row in iter_rows_from_sqlite(args.sqlite, args.source_table))
+
+    def maybe_checkpoint(force=False):
+        if checkpoint["path"] is None and index is None:
+            return
+        confirmed = transport.confirmed_marker
+        if confirmed is None or confirmed == checkpoint["saved"]:
+            return
+        if force or time.monotonic() - checkpoint["at"] >= checkpoint_every:
+            if index is not None:
+                index.confirm(confirmed)
+            else:
+                save_checkpoint(checkpoint["path"], args.sqlite, args.source_table, confirmed)
+            checkpoint["saved"] = confirmed
+            checkpoint["at"] = time.monotonic()
+
+    def send_row(message_bytes, marker, n=1):
+        row_bucket.acquire(n)
+        byte_bucket.acquire(len(message_bytes))
+        transport.send(message_bytes, marker)
+        reporter.record(len(message_bytes), transport, n)
+        maybe_checkpoint()
+        if legacy_interval:
+            time.sleep(legacy_interval)
+
+    try:
+        if workers and workers > 1:
+            for encoded in iter_encoded_parallel(rows, ctx, session, send_handshake, workers, chunk_rows, ordered, fingerprint_of):
+                for marker, message_bytes, n in encoded:
+                    send_row(message_bytes, marker, n)
+        elif ctx["framing"] == "binary":
+            for chunk in iter_row_chunks(rows, ctx["frame_rows"]):
+                if session is not None and session.needs_handshake():
+                    send_handshake()
+                frame = build_frame([row for _, row in chunk], ctx, session.seal if session is not None else None)
+                send_row(frame, chunk[-1][0], len(chunk))
+        else:
+            for marker, row in rows:
+                if session is not None and session.needs_handshake():
+                    send_handshake()
+                fingerprint = fingerprint_of(marker) if fingerprint_of is not None else None
+                send_row(build_message(row, ctx, session.encrypt if session is not None else None, fingerprint), marker)
+        transport.flush()
+        maybe_checkpoint(force=True)
+    finally:
+        transport.close()
+        reporter.summary()
+        if index is not None:
+            print("Sync: " + ", ".join(f"{k} {v}" for k, v in index.counts.items()))
+            index.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,72 +1,769 @@
 import argparse
+import asyncio
+import bisect
 import json
 import socket
 import ssl
 import base64
+import binascii
+import functools
+import hashlib
+import math
+import multiprocessing
+import os
+import queue
+import struct
+import time
 import yaml
 import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pika
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def load_config(path="config.yaml"):
     with open(path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if value is None or self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+class Metrics:
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.enabled = False
+        # Set in worker processes, whose summaries are not aggregated anywhere
+        self.log_prefix = ""
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._null_timer = nullcontext()
+
+    def inc(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def error(self, cause):
+        self.inc("importer_errors_total", cause=cause)
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                # per-bucket counts (last one is +Inf), then sum
+                h = self.histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            h[i] += 1
+            h[-1] += seconds
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return self._null_timer
+        return _MetricsTimer(self, name, labels)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), {k: list(v) for k, v in self.histograms.items()}
+
+    def render(self):
+        counters, histograms = self.snapshot()
+        lines = []
+        for name in sorted({k[0] for k in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        for name in sorted({k[0] for k in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                total = 0
+                for bound, count in zip(self.BUCKETS + ("+Inf",), h[:-1]):
+                    total += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {total}")
+                lines.append(f"{name}_sum{format_labels(labels)} {h[-1]:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+    def quantile(self, h, q):
+        total = sum(h[:-1])
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.BUCKETS + (float("inf"),), h[:-1]):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return None
+
+    def log_summary(self):
+        counters, histograms = self.snapshot()
+        for (name, labels), value in sorted(counters.items()):
+            print(f"{self.log_prefix}Metrics {name}{format_labels(labels)}: {value}")
+        for (name, labels), h in sorted(histograms.items()):
+            count = sum(h[:-1])
+            p99 = self.quantile(h, 0.99)
+            print(f"{self.log_prefix}Metrics {name}{format_labels(labels)}: count={count} avg_ms={h[-1] / count * 1000:.3f} "
+                  f"p99_ms<={p99 * 1000 if p99 != float('inf') else 'inf'}")
+
+class _MetricsTimer:
+    __slots__ = ("metrics", "name", "labels", "t0")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.t0, **self.labels)
+        return False
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+metrics = Metrics()
+
+class TimedCursor(psycopg2.extensions.cursor):
+    # Installed only while metrics are enabled; execute_values goes through execute() as well
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.observe("importer_db_query_seconds", time.perf_counter() - t0)
+
+def db_cursor_factory():
+    return TimedCursor if metrics.enabled else None
+
+def timed_commit(conn, dim_cache=None):
+    with metrics.timer("importer_commit_seconds"):
+        conn.commit()
+    if dim_cache is not None:
+        dim_cache.commit(conn)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def init_metrics(cfg):
+    mc = cfg.get("metrics", {})
+    metrics.enabled = mc.get("enabled", False)
+    if not metrics.enabled:
+        return
+    port = mc.get("http_port", 9100)
+    if port:
+        host = mc.get("http_host", "127.0.0.1")
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Metrics endpoint on http://{host}:{port}/metrics")
+    every = mc.get("log_every_sec", 60)
+    if every:
+        def log_loop():
+            while True:
+                time.sleep(every)
+                metrics.log_summary()
+        threading.Thread(target=log_loop, daemon=True).start()
+
+session_key_cache = LRUCache(1024)
+# custom_session keys arrive once per handshake and must outlive any amount of traffic,
+# so they are kept apart from the per-message custom keys above and never evicted
+session_keys = {}
+_privkey_cache = {}
+_privkey_lock = threading.Lock()
+
 def load_rsa_privkey(path):
     with open(path, "rb") as f:
         return serialization.load_pem_private_key(f.read(), password=None)
 
 def rsa_decrypt(privkey, ciphertext: bytes) -> bytes:
-    return privkey.decrypt(
-        ciphertext,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
+    try:
+        return privkey.decrypt(
+            ciphertext,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
         )
-    )
+    except ValueError as e:
+        # A key wrapped for another key pair is an auth failure, not a malformed message (see MESSAGE_FORMAT_ERRORS)
+        raise RuntimeError("RSA decryption failed: %s" % e)
+
+def get_rsa_privkey(path):
+    with _privkey_lock:
+        priv = _privkey_cache.get(path)
+        if priv is None:
+            priv = load_rsa_privkey(path)
+            _privkey_cache[path] = priv
+        return priv
+
+def init_crypto(cfg):
+    crypto = cfg.get("crypto", {})
+    session_key_cache.maxsize = crypto.get("session_key_cache_size", 1024)
+    privkey_path = crypto.get("importer_privkey_path")
+    if cfg.get("use_custom_crypto", False) and privkey_path:
+        get_rsa_privkey(privkey_path)
+
+def unwrap_session_key(priv, encrypted_key_b64):
+    digest = hashlib.sha256(encrypted_key_b64.encode("ascii")).digest()
+    aes_key = session_key_cache.get(digest)
+    if aes_key is None:
+        aes_key = rsa_decrypt(priv, base64.b64decode(encrypted_key_b64))
+        session_key_cache.put(digest, aes_key)
+    return aes_key
 
 def decrypt_custom(privkey_path, payload):
-    enc_key = base64.b64decode(payload["encrypted_key_b64"])
     iv = base64.b64decode(payload["iv_b64"])
     ct = base64.b64decode(payload["ciphertext_b64"])
-    priv = load_rsa_privkey(privkey_path)
-    aes_key = rsa_decrypt(priv, enc_key)
+    priv = get_rsa_privkey(privkey_path)
+    aes_key = unwrap_session_key(priv, payload["encrypted_key_b64"])
     aesgcm = AESGCM(aes_key)
     pt = aesgcm.decrypt(iv, ct, None)
     return pt
 
-def process_message(raw_bytes, cfg):
+def accept_session_handshake(cfg, payload):
+    privkey_path = cfg.get("crypto", {}).get("importer_privkey_path")
+    if not privkey_path:
+        raise RuntimeError("No importer_privkey_path configured")
+    encrypted_key_b64 = payload["encrypted_key_b64"]
+    digest = hashlib.sha256(encrypted_key_b64.encode("ascii")).digest()
+    if digest.hex() != payload.get("key_id"):
+        raise RuntimeError("Session key id does not match wrapped key")
+    if digest not in session_keys:
+        session_keys[digest] = rsa_decrypt(get_rsa_privkey(privkey_path), base64.b64decode(encrypted_key_b64))
+
+def session_key(digest):
+    aes_key = session_keys.get(digest)
+    if aes_key is None:
+        metrics.error("unknown_session_key")
+        raise RuntimeError("Unknown session key %s, handshake not received" % digest.hex())
+    return aes_key
+
+def decrypt_session(payload):
+    key_id = payload["key_id"]
+    aes_key = session_key(bytes.fromhex(key_id))
+    nonce = int(payload["seq"]).to_bytes(12, "big")
+    ct = base64.b64decode(payload["ciphertext_b64"])
+    return AESGCM(aes_key).decrypt(nonce, ct, key_id.encode("ascii"))
+
+class BloomFilter:
+    def __init__(self, capacity, fp_rate):
+        self.capacity = max(1, int(capacity))
+        self.bits = max(8, int(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.data = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # key is already a uniform digest: double hashing over its two halves
+        h1 = int.from_bytes(key[:8], "big")
+        h2 = int.from_bytes(key[8:16], "big") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+def row_key(row):
+    # Same canonical form and digest as the exporter's row fingerprint
+    canonical = json.dumps(row, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+class IdempotencyFilter:
+    # Bloom filter over every key in import_seen_keys plus an exact LRU of recent keys. A Bloom hit
+    # that is not in the LRU is confirmed against the table before the message is dropped
+    def __init__(self, cfg, capacity=10000000, fp_rate=0.001, recent_size=100000):
+        self.cfg = cfg
+        self.bloom = BloomFilter(capacity, fp_rate)
+        self.recent = LRUCache(recent_size)
+        self.lock = threading.Lock()
+        self.bloom_lock = threading.Lock()
+        self.conn = None
+        self.warned_full = False
+
+    def connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = get_db_conn(dict(self.cfg, batch={"enabled": False}))
+        return self.conn
+
+    def load(self, retention_days=None):
+        with self.lock:
+            conn = self.connect()
+            if retention_days:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM import_seen_keys WHERE seen_at < now() - %s * INTERVAL '1 day'", (retention_days,))
+            conn.autocommit = False
+            try:
+                with conn.cursor(name="seen_keys") as cur:
+                    cur.itersize = 50000
+                    cur.execute("SELECT key FROM import_seen_keys")
+                    for (key,) in cur:
+                        self.bloom.add(bytes(key))
+                conn.rollback()
+            finally:
+                conn.autocommit = True
+        print(f"Idempotency filter loaded {self.bloom.count} keys "
+              f"({len(self.bloom.data) // 1024} KiB, {self.bloom.hashes} hashes)")
+
+    def is_duplicate(self, key):
+        if key not in self.bloom:
+            return False
+        if self.recent.get(key) is not None:
+            return True
+        with self.lock:
+            with self.connect().cursor() as cur:
+                cur.execute("SELECT 1 FROM import_seen_keys WHERE key = %s", (key,))
+                found = cur.fetchone() is not None
+        if found:
+            self.recent.put(key, True)
+        else:
+            metrics.inc("importer_idempotency_false_positives_total")
+        return found
+
+    def record(self, cur, keys):
+        # Runs inside the transaction that stores the rows, so a rolled back batch leaves no keys behind
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO import_seen_keys (key) VALUES %s ON CONFLICT DO NOTHING",
+            [(psycopg2.Binary(k),) for k in keys], page_size=max(1, len(keys))
+        )
+
+    def confirm(self, keys):
+        with self.bloom_lock:
+            for key in keys:
+                self.bloom.add(key)
+        for key in keys:
+            self.recent.put(key, True)
+        if self.bloom.count > self.bloom.capacity and not self.warned_full:
+            self.warned_full = True
+            print("Idempotency filter is over capacity, false positives will rise; increase idempotency.capacity")
+
+idempotency = None
+
+def init_idempotency(cfg):
+    global idempotency
+    ic = cfg.get("idempotency", {})
+    if not ic.get("enabled", False):
+        idempotency = None
+        return
+    idempotency = IdempotencyFilter(cfg, ic.get("capacity", 10000000), ic.get("fp_rate", 0.001), ic.get("recent_size", 100000))
+    idempotency.load(ic.get("retention_days"))
+
+def drop_duplicates(rows):
+    if idempotency is None:
+        return rows
+    fresh = []
+    for row in rows:
+        if idempotency.is_duplicate(row_key(row)):
+            metrics.inc("importer_duplicates_total")
+        else:
+            fresh.append(row)
+    return fresh
+
+json_decoder = json.JSONDecoder()
+
+def json_loads(data):
+    # orjson parses bytes and memoryviews in place. The stdlib fallback decodes UTF-8 straight from the
+    # buffer, skipping json.loads' encoding detection, since every sender writes UTF-8
+    if orjson is not None:
+        return orjson.loads(data)
+    return json_decoder.decode(data if isinstance(data, str) else str(data, "utf-8"))
+
+def decode_message(raw_bytes, cfg, sessions=True):
     try:
-        obj = json.loads(raw_bytes.decode("utf-8"))
+        with metrics.timer("importer_step_seconds", step="parse_json"):
+            obj = json_loads(raw_bytes)
     except Exception as e:
         print("Invalid JSON:", e)
+        metrics.error("invalid_json")
         return None
+    return decode_envelope(obj, cfg, sessions)
+
+def decode_envelope(obj, cfg, sessions=True):
     scheme = obj.get("scheme")
     payload = obj.get("payload")
     if scheme == "custom":
         privkey_path = cfg.get("crypto", {}).get("importer_privkey_path")
         if not privkey_path:
             raise RuntimeError("No importer_privkey_path configured")
-        plaintext = decrypt_custom(privkey_path, payload)
+        with metrics.timer("importer_step_seconds", step="decrypt_custom"):
+            plaintext = decrypt_custom(privkey_path, payload)
+    elif scheme == "custom_session":
+        if not sessions:
+            metrics.error("session_not_supported")
+            raise RuntimeError("custom_session is not supported over RabbitMQ")
+        if obj.get("type") == "handshake":
+            with metrics.timer("importer_step_seconds", step="session_handshake"):
+                accept_session_handshake(cfg, payload)
+            return None
+        with metrics.timer("importer_step_seconds", step="decrypt_session"):
+            plaintext = decrypt_session(payload)
     elif scheme == "tls" or scheme == "plain":
-        b64 = payload.get("plaintext_b64")
-        plaintext = base64.b64decode(b64)
+        plaintext = binascii.a2b_base64(payload.get("plaintext_b64"))
     else:
-        raise RuntimeError("Unknown scheme: %s" % scheme)
+        metrics.error("unknown_scheme")
+        raise ValueError("Unknown scheme: %s" % scheme)
     try:
-        data = json.loads(plaintext.decode("utf-8"))
+        with metrics.timer("importer_step_seconds", step="parse_inner_json"):
+            data = json_loads(plaintext)
     except Exception as e:
         print("Failed to parse inner JSON:", e)
+        metrics.error("invalid_inner_json")
+        return None
+    if idempotency is not None and idempotency.is_duplicate(row_key(data)):
+        metrics.inc("importer_duplicates_total")
         return None
     return data
 
+def process_message(raw_bytes, cfg, sessions=True):
+    if not metrics.enabled:
+        return decode_message(raw_bytes, cfg, sessions)
+    try:
+        with metrics.timer("importer_process_message_seconds"):
+            row = decode_message(raw_bytes, cfg, sessions)
+    except Exception as e:
+        metrics.error("decode_" + type(e).__name__)
+        raise
+    metrics.inc("importer_messages_total", result="row" if row is not None else "skipped")
+    return row
+
+# What a malformed envelope raises while decoding. Crypto and session key failures (RuntimeError,
+# InvalidTag) are left out: they are not the message's fault and must not cost its row
+MESSAGE_FORMAT_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+
+def decode_messages(lines, cfg):
+    # All envelopes of a batch go through one parser call over a synthetic JSON array; lines may be
+    # memoryview slices of the receive buffer, copied once by the join. A batch with a malformed
+    # line is decoded again line by line, so only that line is lost
+    if not lines:
+        return []
+    try:
+        with metrics.timer("importer_step_seconds", step="parse_json"):
+            envelopes = json_loads(b"[" + b",".join(lines) + b"]")
+        if len(envelopes) != len(lines) or not all(isinstance(obj, dict) for obj in envelopes):
+            raise ValueError("Batch does not split into one envelope per line")
+    except ValueError:
+        envelopes = None
+    rows = []
+    with metrics.timer("importer_decode_batch_seconds"):
+        for i, line in enumerate(lines):
+            try:
+                if envelopes is None:
+                    row = decode_message(bytes(line), cfg)
+                else:
+                    row = decode_envelope(envelopes[i], cfg)
+            except MESSAGE_FORMAT_ERRORS as e:
+                # Only the malformed message is lost; the rest of the batch is still stored
+                print("Message rejected:", e)
+                metrics.error("decode_" + type(e).__name__)
+                continue
+            if row is not None:
+                rows.append(row)
+    metrics.inc("importer_messages_total", len(rows), result="row")
+    if len(rows) < len(lines):
+        metrics.inc("importer_messages_total", len(lines) - len(rows), result="skipped")
+    return rows
+
+# Binary streams start with STREAM_MAGIC, a version byte and a length-prefixed JSON header
+# (source_table, scheme, compression). Every frame is FRAME_HEADER (kind, body length) + body;
+# a rows frame carries a JSON array of rows, compressed and then sealed as a whole.
+STREAM_MAGIC = b"PSUB"
+STREAM_VERSION = 1
+STREAM_PREFIX = struct.Struct(">4sBH")
+FRAME_HEADER = struct.Struct(">BI")
+FRAME_ROWS = 1
+FRAME_HANDSHAKE = 2
+SESSION_KEY_ID_BYTES = 32
+SESSION_SEQ_BYTES = 8
+
+def parse_stream_header(buf):
+    if len(buf) < STREAM_PREFIX.size:
+        return None
+    magic, version, header_len = STREAM_PREFIX.unpack_from(buf, 0)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a binary stream")
+    if version != STREAM_VERSION:
+        raise ValueError("Unsupported stream version: %s" % version)
+    end = STREAM_PREFIX.size + header_len
+    if len(buf) < end:
+        return None
+    return json.loads(bytes(buf[STREAM_PREFIX.size:end])), end
+
+def iter_frames(buf, pos=0, max_frame_bytes=None):
+    while len(buf) - pos >= FRAME_HEADER.size:
+        kind, length = FRAME_HEADER.unpack_from(buf, pos)
+        if max_frame_bytes and length > max_frame_bytes:
+            raise ValueError("Frame of %d bytes exceeds max_frame_bytes" % length)
+        end = pos + FRAME_HEADER.size + length
+        if end > len(buf):
+            return
+        yield kind, bytes(buf[pos + FRAME_HEADER.size:end]), end
+        pos = end
+
+def open_session_frame(body):
+    digest = bytes(body[:SESSION_KEY_ID_BYTES])
+    aes_key = session_key(digest)
+    seq_end = SESSION_KEY_ID_BYTES + SESSION_SEQ_BYTES
+    nonce = int.from_bytes(body[SESSION_KEY_ID_BYTES:seq_end], "big").to_bytes(12, "big")
+    return AESGCM(aes_key).decrypt(nonce, body[seq_end:], digest.hex().encode("ascii"))
+
+def decompress(body, codec):
+    if codec == "zlib":
+        return zlib.decompress(body)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(body)
+    return body
+
+class FrameDecoder:
+    SCHEMES = ("plain", "tls", "custom_session")
+
+    def __init__(self, cfg, header):
+        self.cfg = cfg
+        self.scheme = header.get("scheme")
+        self.compression = header.get("compression", "none")
+        self.source_table = header.get("source_table")
+        if self.scheme not in self.SCHEMES:
+            raise RuntimeError("Unsupported scheme for binary frames: %s" % self.scheme)
+        if self.compression not in ("none", "zlib", "zstd"):
+            raise RuntimeError("Unknown compression: %s" % self.compression)
+        if self.compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd-compressed stream received but the zstandard module is not installed")
+
+    def decode(self, kind, body):
+        if kind == FRAME_HANDSHAKE:
+            with metrics.timer("importer_step_seconds", step="session_handshake"):
+                accept_session_handshake(self.cfg, json_loads(body))
+            return []
+        if kind != FRAME_ROWS:
+            metrics.error("unknown_frame")
+            raise RuntimeError("Unknown frame kind: %s" % kind)
+        if self.scheme == "custom_session":
+            with metrics.timer("importer_step_seconds", step="decrypt_session"):
+                body = open_session_frame(body)
+        with metrics.timer("importer_step_seconds", step="decode_frame"):
+            body = decompress(body, self.compression)
+            try:
+                rows = json_loads(body)
+            except ValueError as e:
+                print("Failed to parse frame JSON:", e)
+                metrics.error("invalid_inner_json")
+                return []
+        metrics.inc("importer_messages_total", len(rows), result="row")
+        return drop_duplicates(rows)
+
+def process_body(raw_bytes, cfg):
+    # A RabbitMQ body is either one JSON message or a whole binary stream (header plus frames).
+    # custom_session is refused: its handshake reaches a single consumer and its key is gone after
+    # a restart, so queued rows could not be decrypted. Errors raised here get the delivery nacked
+    if not raw_bytes.startswith(STREAM_MAGIC):
+        row = process_message(raw_bytes, cfg, sessions=False)
+        return [] if row is None else [row]
+    parsed = parse_stream_header(raw_bytes)
+    if parsed is None:
+        metrics.error("truncated_frame")
+        raise ValueError("Truncated binary message")
+    header, pos = parsed
+    if header.get("scheme") == "custom_session":
+        metrics.error("session_not_supported")
+        raise RuntimeError("custom_session is not supported over RabbitMQ")
+    decoder = FrameDecoder(cfg, header)
+    rows = []
+    for kind, body, pos in iter_frames(raw_bytes, pos):
+        rows.extend(decoder.decode(kind, body))
+    if pos != len(raw_bytes):
+        metrics.error("truncated_frame")
+        raise ValueError("Truncated binary message")
+    return rows
+
+class DimensionCache:
+    DIMENSIONS = ("patients", "doctors", "departments", "diagnoses")
+
+    # Keys are tuples of the natural key columns in both the row and the batch path. The cache is
+    # shared by every connection, so ids created inside a transaction stay pending for that
+    # connection and are published by commit(); rollback() drops them
+    def __init__(self, sizes, stats_every=0):
+        self.caches = {dim: LRUCache(int(sizes.get(dim, 0))) for dim in self.DIMENSIONS}
+        self.stats_every = stats_every
+        self.processed = 0
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def _get(self, conn, dim, key):
+        value = self.caches[dim].get(key)
+        if value is None:
+            value = self.pending.get(conn, {}).get((dim, key))
+        return value
+
+    def _remember(self, conn, dim, key, value):
+        if value is None:
+            return
+        if conn.autocommit:
+            self.caches[dim].put(key, value)
+        else:
+            with self.lock:
+                self.pending.setdefault(conn, {})[(dim, key)] = value
+
+    def lookup(self, dim, key, create, cur, *args):
+        value = self._get(cur.connection, dim, key)
+        if value is not None:
+            return value
+        value = create(cur, *args)
+        self._remember(cur.connection, dim, key, value)
+        return value
+
+    def resolve_many(self, dim, keys, fetch, conn):
+        ids = {}
+        missing = []
+        for key in keys:
+            value = self._get(conn, dim, key)
+            if value is None:
+                missing.append(key)
+            else:
+                ids[key] = value
+        if missing:
+            fetched = fetch(missing)
+            for key, value in fetched.items():
+                self._remember(conn, dim, key, value)
+            ids.update(fetched)
+        return ids
+
+    def commit(self, conn):
+        with self.lock:
+            pending = self.pending.pop(conn, None)
+        for (dim, key), value in (pending or {}).items():
+            self.caches[dim].put(key, value)
+
+    def rollback(self, conn):
+        with self.lock:
+            self.pending.pop(conn, None)
+
+    def stats(self):
+        return {dim: cache.stats() for dim, cache in self.caches.items()}
+
+    def log_stats(self):
+        for dim, st in self.stats().items():
+            print(f"Dimension cache {dim}: size={st['size']}/{st['maxsize']} hits={st['hits']} misses={st['misses']} hit_ratio={st['hit_ratio']}")
+
+    def tick(self, n=1):
+        if not self.stats_every:
+            return
+        with self.lock:
+            before = self.processed
+            self.processed += n
+            due = self.processed // self.stats_every != before // self.stats_every
+        if due:
+            self.log_stats()
+
+def build_dimension_cache(cfg):
+    dc = cfg.get("dimension_cache", {})
+    if not dc.get("enabled", False):
+        return None
+    default_size = dc.get("size", 10000)
+    sizes = {dim: dc.get("sizes", {}).get(dim, default_size) for dim in DimensionCache.DIMENSIONS}
+    return DimensionCache(sizes, dc.get("stats_every", 0))
+
+def get_db_pool(cfg, size):
+    pg = cfg.get("postgres", {})
+    return psycopg2.pool.ThreadedConnectionPool(
+        1,
+        size,
+        dbname=pg["dbname"],
+        user=pg["user"],
+        password=pg["password"],
+        host=pg.get("host", "127.0.0.1"),
+        port=pg.get("port", 5432),
+        cursor_factory=db_cursor_factory()
+    )
+
 def get_db_conn(cfg):
     pg = cfg.get("postgres", {})
     conn = psycopg2.connect(
@@ -74,19 +771,49 @@ def get_db_conn(cfg):
         user=pg["user"],
         password=pg["password"],
         host=pg.get("host", "127.0.0.1"),
-        port=pg.get("port", 5432)
+        port=pg.get("port", 5432),
+        cursor_factory=db_cursor_factory()
     )
-    conn.autocommit = True
+    conn.autocommit = not cfg.get("batch", {}).get("enabled", False)
     return conn
 
+DATETIME_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+last_datetime_format = DATETIME_FORMATS[0]
+
+def parse_iso_datetime(s):
+    # Zero-padded forms of DATETIME_FORMATS without strptime; anything else returns None
+    n = len(s)
+    if n not in (10, 16, 19) or s[4] != "-" or s[7] != "-" or not s.isascii():
+        return None
+    if n == 10:
+        parts = (s[:4], s[5:7], s[8:10])
+    elif s[13] == ":" and ((n == 16 and s[10] == " ") or (n == 19 and s[10] in " T" and s[16] == ":")):
+        parts = (s[:4], s[5:7], s[8:10], s[11:13], s[14:16], s[17:19]) if n == 19 else (s[:4], s[5:7], s[8:10], s[11:13], s[14:16])
+    else:
+        return None
+    if not all(p.isdigit() for p in parts):
+        return None
+    try:
+        return datetime(*map(int, parts))
+    except ValueError:
+        return None
+
 def parse_datetime(s):
+    global last_datetime_format
     if s is None:
         return None
-    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+    if isinstance(s, str):
+        dt = parse_iso_datetime(s)
+        if dt is not None:
+            return dt
+    # A stream sticks to one layout, so the format that matched last is tried first
+    for fmt in (last_datetime_format,) + DATETIME_FORMATS:
         try:
-            return datetime.strptime(s, fmt)
+            dt = datetime.strptime(s, fmt)
         except Exception:
-            pass
+            continue
+        last_datetime_format = fmt
+        return dt
     return None
 
 def get_or_create_patient(cur, full_name, birth_date):
@@ -144,11 +871,15 @@ def get_or_create_diagnosis(cur, name):
     return rr[0] if rr else None
 
 def get_or_create_appointment(cur, patient_id, doctor_id, department_id, appointment_datetime, complaints, diagnosis_id):
+    # A row re-sent by the exporter's sync mode carries the appointment's current complaints and
+    # department; an unchanged row is not rewritten and is found by the SELECT below
     cur.execute(
         """
         INSERT INTO appointments (patient_id, doctor_id, department_id, appointment_date, complaints)
         VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (patient_id, doctor_id, appointment_date) DO NOTHING
+        ON CONFLICT (patient_id, doctor_id, appointment_date) DO UPDATE
+        SET complaints = EXCLUDED.complaints, department_id = EXCLUDED.department_id
+        WHERE (appointments.complaints, appointments.department_id) IS DISTINCT FROM (EXCLUDED.complaints, EXCLUDED.department_id)
         RETURNING id
         """,
         (patient_id, doctor_id, department_id, appointment_datetime, complaints)
@@ -163,45 +894,883 @@ def get_or_create_appointment(cur, patient_id, doctor_id, department_id, appoint
     rr = cur.fetchone()
     return rr[0] if rr else None
 
-def apply_normalization_and_insert(conn, row):
+partition_months = None
+_partition_lock = threading.Lock()
+
+def init_partitioning(cfg):
+    global partition_months
+    partition_months = set() if cfg.get("postgres", {}).get("partitioned_appointments", False) else None
+
+def ensure_appointment_partitions(conn, cur, datetimes):
+    if partition_months is None:
+        return
+    with _partition_lock:
+        months = {}
+        for dt in datetimes:
+            if dt is not None and (dt.year, dt.month) not in partition_months:
+                months[(dt.year, dt.month)] = dt
+    if not months:
+        return
+    for dt in months.values():
+        cur.execute("SELECT ensure_appointments_partition(%s)", (dt,))
+    # Called before any other write of the transaction: committing here makes the new
+    # partitions visible to the other pooled connections without touching row data
+    if not conn.autocommit:
+        timed_commit(conn)
+    with _partition_lock:
+        partition_months.update(months)
+
+bump_data_version_enabled = True
+data_version_dirty = threading.Event()
+
+def init_data_version(cfg):
+    # Not optional: create_report.ReportCache serves a cached report for as long as the version stands
+    pg = cfg.get("postgres", {})
+    threading.Thread(target=bump_data_version_loop, args=(cfg, pg.get("data_version_interval_sec", 1.0)), daemon=True).start()
+
+def mark_data_changed():
+    if bump_data_version_enabled:
+        data_version_dirty.set()
+
+def bump_data_version_loop(cfg, interval):
+    # Autocommitted rows only mark the data as changed: one nextval per interval at most,
+    # so cached reports may lag that long behind row-by-row imports
+    conn = None
+    while True:
+        data_version_dirty.wait()
+        time.sleep(interval)
+        data_version_dirty.clear()
+        try:
+            if conn is None or conn.closed:
+                conn = get_db_conn(dict(cfg, batch={"enabled": False}))
+            if not bump_data_version(conn) and bump_data_version_enabled:
+                data_version_dirty.set()
+        except Exception as e:
+            print("Data version bump failed:", e)
+            metrics.error("data_version")
+            data_version_dirty.set()
+            conn = None
+
+def bump_data_version(conn):
+    # Only after commit: a report cached under the new version must already see the rows
+    global bump_data_version_enabled
+    if not bump_data_version_enabled:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT nextval('import_data_version')")
+        if not conn.autocommit:
+            conn.commit()
+        return True
+    except psycopg2.errors.UndefinedTable:
+        # Without migration 005 create_report has no version to cache against and does not cache
+        conn.rollback()
+        bump_data_version_enabled = False
+        print("Sequence import_data_version is missing (apply migrations/005), data version bumps disabled")
+    except Exception as e:
+        print("Data version bump failed:", e)
+        metrics.error("data_version")
+        conn.rollback()
+    return False
+
+def apply_normalization_and_insert(conn, row, dim_cache=None):
     with conn.cursor() as cur:
         try:
-            patient_id = get_or_create_patient(cur, row.get("patient_full_name"), row.get("patient_birth_date"))
-            doctor_id = get_or_create_doctor(cur, row.get("doctor_full_name"), row.get("doctor_specialization"))
-            dept_id = get_or_create_department(cur, row.get("department_name"))
-            diag_id = get_or_create_diagnosis(cur, row.get("diagnosis_name"))
-            appt_dt = parse_datetime(row.get("appointment_date"))
+            with metrics.timer("importer_step_seconds", step="parse_date"):
+                appt_dt = parse_datetime(row.get("appointment_date"))
+            with metrics.timer("importer_step_seconds", step="ensure_partition"):
+                ensure_appointment_partitions(conn, cur, (appt_dt,))
+            patient_key = (row.get("patient_full_name"), row.get("patient_birth_date"))
+            doctor_key = (row.get("doctor_full_name"), row.get("doctor_specialization"))
+            if dim_cache is not None:
+                with metrics.timer("importer_step_seconds", step="patient"):
+                    patient_id = dim_cache.lookup("patients", patient_key, get_or_create_patient, cur, *patient_key)
+                with metrics.timer("importer_step_seconds", step="doctor"):
+                    doctor_id = dim_cache.lookup("doctors", doctor_key, get_or_create_doctor, cur, *doctor_key)
+                with metrics.timer("importer_step_seconds", step="department"):
+                    dept_id = dim_cache.lookup("departments", (row.get("department_name"),), get_or_create_department, cur, row.get("department_name"))
+                with metrics.timer("importer_step_seconds", step="diagnosis"):
+                    diag_id = dim_cache.lookup("diagnoses", (row.get("diagnosis_name"),), get_or_create_diagnosis, cur, row.get("diagnosis_name"))
+                dim_cache.tick()
+            else:
+                with metrics.timer("importer_step_seconds", step="patient"):
+                    patient_id = get_or_create_patient(cur, *patient_key)
+                with metrics.timer("importer_step_seconds", step="doctor"):
+                    doctor_id = get_or_create_doctor(cur, *doctor_key)
+                with metrics.timer("importer_step_seconds", step="department"):
+                    dept_id = get_or_create_department(cur, row.get("department_name"))
+                with metrics.timer("importer_step_seconds", step="diagnosis"):
+                    diag_id = get_or_create_diagnosis(cur, row.get("diagnosis_name"))
             complaints = row.get("complaints")
-            appt_id = get_or_create_appointment(cur, patient_id, doctor_id, dept_id, appt_dt, complaints, diag_id)
+            with metrics.timer("importer_step_seconds", step="appointment"):
+                appt_id = get_or_create_appointment(cur, patient_id, doctor_id, dept_id, appt_dt, complaints, diag_id)
 
-            if appt_id and diag_id:
-                cur.execute("INSERT INTO appointment_diagnoses (appointment_id, diagnosis_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (appt_id, diag_id))
+            if appt_id:
+                with metrics.timer("importer_step_seconds", step="appointment_diagnosis"):
+                    # A source row holds the appointment's only diagnosis: one replaced in the source replaces it here
+                    cur.execute("DELETE FROM appointment_diagnoses WHERE appointment_id = %s AND diagnosis_id IS DISTINCT FROM %s", (appt_id, diag_id))
+                    if diag_id:
+                        cur.execute("INSERT INTO appointment_diagnoses (appointment_id, diagnosis_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (appt_id, diag_id))
+            if idempotency is not None:
+                key = row_key(row)
+                idempotency.record(cur, [key])
+                if conn.autocommit:
+                    idempotency.confirm([key])
+            if conn.autocommit:
+                mark_data_changed()
+            metrics.inc("importer_rows_total", path="row")
             return appt_id
         except Exception as e:
             print("Normalization DB error:", e)
+            metrics.error("db_row")
+            if dim_cache is not None:
+                dim_cache.rollback(conn)
             conn.rollback()
             return None
 
-def socket_worker(client_sock, addr, cfg, db_conn):
+BATCH_UPSERT_PATIENTS = """
+    WITH v (idx, full_name, birth_date) AS (VALUES %s),
+    ins AS (
+        INSERT INTO patients (full_name, birth_date)
+        SELECT full_name, birth_date FROM v
+        ON CONFLICT (full_name, birth_date) DO NOTHING
+        RETURNING id, full_name, birth_date
+    )
+    SELECT v.idx, COALESCE(ins.id, p.id)
+    FROM v
+    LEFT JOIN ins ON ins.full_name = v.full_name AND ins.birth_date IS NOT DISTINCT FROM v.birth_date
+    LEFT JOIN patients p ON p.full_name = v.full_name AND p.birth_date = v.birth_date
+"""
+
+BATCH_UPSERT_DOCTORS = """
+    WITH v (idx, full_name, specialization) AS (VALUES %s),
+    ins AS (
+        INSERT INTO doctors (full_name, specialization)
+        SELECT full_name, specialization FROM v
+        ON CONFLICT (full_name, specialization) DO NOTHING
+        RETURNING id, full_name, specialization
+    )
+    SELECT v.idx, COALESCE(ins.id, d.id)
+    FROM v
+    LEFT JOIN ins ON ins.full_name = v.full_name AND ins.specialization IS NOT DISTINCT FROM v.specialization
+    LEFT JOIN doctors d ON d.full_name = v.full_name AND d.specialization = v.specialization
+"""
+
+BATCH_UPSERT_DEPARTMENTS = """
+    WITH v (idx, name) AS (VALUES %s),
+    ins AS (
+        INSERT INTO departments (name) SELECT name FROM v
+        ON CONFLICT (name) DO NOTHING
+        RETURNING id, name
+    )
+    SELECT v.idx, COALESCE(ins.id, d.id)
+    FROM v
+    LEFT JOIN ins ON ins.name = v.name
+    LEFT JOIN departments d ON d.name = v.name
+"""
+
+BATCH_UPSERT_DIAGNOSES = """
+    WITH v (idx, name) AS (VALUES %s),
+    ins AS (
+        INSERT INTO diagnoses (name) SELECT name FROM v
+        ON CONFLICT (name) DO NOTHING
+        RETURNING id, name
+    )
+    SELECT v.idx, COALESCE(ins.id, d.id)
+    FROM v
+    LEFT JOIN ins ON ins.name = v.name
+    LEFT JOIN diagnoses d ON d.name = v.name
+"""
+
+BATCH_UPSERT_APPOINTMENTS = """
+    WITH v (idx, patient_id, doctor_id, department_id, appointment_date, complaints) AS (VALUES %s),
+    ins AS (
+        INSERT INTO appointments (patient_id, doctor_id, department_id, appointment_date, complaints)
+        SELECT patient_id, doctor_id, department_id, appointment_date, complaints FROM v
+        ON CONFLICT (patient_id, doctor_id, appointment_date) DO UPDATE
+        SET complaints = EXCLUDED.complaints, department_id = EXCLUDED.department_id
+        WHERE (appointments.complaints, appointments.department_id) IS DISTINCT FROM (EXCLUDED.complaints, EXCLUDED.department_id)
+        RETURNING id, patient_id, doctor_id, appointment_date
+    )
+    SELECT v.idx, COALESCE(ins.id, a.id)
+    FROM v
+    LEFT JOIN ins
+      ON ins.patient_id = v.patient_id
+     AND ins.doctor_id = v.doctor_id
+     AND ins.appointment_date IS NOT DISTINCT FROM v.appointment_date
+    LEFT JOIN appointments a
+      ON a.patient_id = v.patient_id
+     AND a.doctor_id = v.doctor_id
+     AND a.appointment_date = v.appointment_date
+"""
+
+# Same rule as the row path: the diagnoses of a batch's rows replace any others of their appointments
+DELETE_STALE_DIAGNOSES = """
+    WITH v (appointment_id, diagnosis_id) AS (VALUES %s)
+    DELETE FROM appointment_diagnoses ad
+    WHERE ad.appointment_id IN (SELECT appointment_id FROM v)
+      AND NOT EXISTS (
+          SELECT 1 FROM v WHERE v.appointment_id = ad.appointment_id AND v.diagnosis_id = ad.diagnosis_id
+      )
+"""
+
+def upsert_batch(cur, sql, keys, template, extra=None):
+    if not keys:
+        return {}
+    ids = {}
+    # Under READ COMMITTED a key committed by another connection after this statement's snapshot
+    # is skipped by ON CONFLICT DO NOTHING and invisible to the join; the next statement sees it
+    for _ in range(3):
+        values = [(i,) + key + (extra[key] if extra else ()) for i, key in enumerate(keys)]
+        result = psycopg2.extras.execute_values(cur, sql, values, template=template, page_size=len(values), fetch=True)
+        for idx, id_ in result:
+            if id_ is not None:
+                ids[keys[idx]] = id_
+        keys = [key for key in keys if key not in ids]
+        if not keys:
+            return ids
+    raise RuntimeError("Batch upsert left %d keys without an id" % len(keys))
+
+def resolve_dimension(cur, dim_cache, dim, keys, sql, template):
+    fetch = lambda missing: upsert_batch(cur, sql, missing, template)
+    if dim_cache is None:
+        return fetch(keys)
+    return dim_cache.resolve_many(dim, keys, fetch, cur.connection)
+
+def unique_keys(values):
+    return list(dict.fromkeys(v for v in values if v is not None))
+
+def normalize_batch(cur, rows, dim_cache=None):
+    with metrics.timer("importer_step_seconds", step="parse_date"):
+        appt_dts = [parse_datetime(r.get("appointment_date")) for r in rows]
+    with metrics.timer("importer_step_seconds", step="ensure_partition"):
+        ensure_appointment_partitions(cur.connection, cur, appt_dts)
+    patient_keys = [(r.get("patient_full_name"), r.get("patient_birth_date")) for r in rows]
+    doctor_keys = [(r.get("doctor_full_name"), r.get("doctor_specialization")) for r in rows]
+    dept_keys = [(r.get("department_name"),) if r.get("department_name") else None for r in rows]
+    diag_keys = [(r.get("diagnosis_name"),) if r.get("diagnosis_name") else None for r in rows]
+
+    with metrics.timer("importer_step_seconds", step="batch_patients"):
+        patients = resolve_dimension(cur, dim_cache, "patients", unique_keys(patient_keys), BATCH_UPSERT_PATIENTS, "(%s, %s, %s::date)")
+    with metrics.timer("importer_step_seconds", step="batch_doctors"):
+        doctors = resolve_dimension(cur, dim_cache, "doctors", unique_keys(doctor_keys), BATCH_UPSERT_DOCTORS, "(%s, %s, %s)")
+    with metrics.timer("importer_step_seconds", step="batch_departments"):
+        departments = resolve_dimension(cur, dim_cache, "departments", unique_keys(dept_keys), BATCH_UPSERT_DEPARTMENTS, "(%s, %s)")
+    with metrics.timer("importer_step_seconds", step="batch_diagnoses"):
+        diagnoses = resolve_dimension(cur, dim_cache, "diagnoses", unique_keys(diag_keys), BATCH_UPSERT_DIAGNOSES, "(%s, %s)")
+    if dim_cache is not None:
+        dim_cache.tick(len(rows))
+
+    appt_keys = []
+    appt_extra = {}
+    for i, r in enumerate(rows):
+        key = (patients.get(patient_keys[i]), doctors.get(doctor_keys[i]), appt_dts[i])
+        appt_keys.append(key)
+        if key not in appt_extra:
+            appt_extra[key] = (departments.get(dept_keys[i]), r.get("complaints"))
+    with metrics.timer("importer_step_seconds", step="batch_appointments"):
+        appointments = upsert_batch(
+            cur, BATCH_UPSERT_APPOINTMENTS, list(appt_extra), "(%s, %s::int, %s::int, %s::int, %s::timestamp, %s)", appt_extra
+        )
+
+    links = set()
+    for i in range(len(rows)):
+        appt_id = appointments.get(appt_keys[i])
+        if appt_id:
+            links.add((appt_id, diagnoses.get(diag_keys[i])))
+    if links:
+        with metrics.timer("importer_step_seconds", step="batch_stale_diagnoses"):
+            psycopg2.extras.execute_values(cur, DELETE_STALE_DIAGNOSES, list(links), template="(%s::int, %s::int)", page_size=len(links))
+        links = {link for link in links if link[1]}
+    if links:
+        with metrics.timer("importer_step_seconds", step="batch_appointment_diagnoses"):
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO appointment_diagnoses (appointment_id, diagnosis_id) VALUES %s ON CONFLICT DO NOTHING",
+                sorted(links),
+                page_size=len(links)
+            )
+    if idempotency is not None:
+        keys = list(dict.fromkeys(row_key(r) for r in rows))
+        idempotency.record(cur, keys)
+        return keys
+    return []
+
+def apply_batch_and_insert(conn, rows, dim_cache=None):
+    if not rows:
+        return
+    try:
+        with conn.cursor() as cur:
+            keys = normalize_batch(cur, rows, dim_cache)
+        timed_commit(conn, dim_cache)
+        if idempotency is not None:
+            idempotency.confirm(keys)
+        bump_data_version(conn)
+        metrics.inc("importer_rows_total", len(rows), path="batch")
+        metrics.inc("importer_batches_total")
+        return
+    except Exception as e:
+        print("Batch normalization DB error, retrying row by row:", e)
+        metrics.error("db_batch")
+        if dim_cache is not None:
+            dim_cache.rollback(conn)
+        conn.rollback()
+    for row in rows:
+        stored = apply_normalization_and_insert(conn, row, dim_cache) is not None
+        timed_commit(conn, dim_cache)
+        if stored and idempotency is not None and not conn.autocommit:
+            idempotency.confirm([row_key(row)])
+    if not conn.autocommit:
+        bump_data_version(conn)
+
+class BatchWriter:
+    def __init__(self, conn, dim_cache=None, max_rows=500, max_wait_ms=200, on_commit=None, on_failure=None):
+        self.conn = conn
+        self.dim_cache = dim_cache
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self.on_commit = on_commit
+        self.on_failure = on_failure
+        self.lock = threading.Lock()
+        self.rows = []
+        self.tokens = []
+        self.first_at = None
+
+    def add(self, row, token=None):
+        self.add_rows([] if row is None else [row], token)
+
+    def add_rows(self, rows, token=None):
+        # The token goes in together with its rows, so a flush triggered here settles it as well
+        with self.lock:
+            if self.first_at is None:
+                self.first_at = time.monotonic()
+            self.rows.extend(rows)
+            if token is not None:
+                self.tokens.append(token)
+            if len(self.rows) >= self.max_rows or len(self.tokens) >= self.max_rows:
+                self._flush_locked()
+
+    def due(self):
+        return self.first_at is not None and time.monotonic() - self.first_at >= self.max_wait
+
+    def flush_if_due(self):
+        with self.lock:
+            if self.due():
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        # Tokens are settled only once the outcome of their rows is known: acked after the commit,
+        # handed to on_failure (which requeues the deliveries) when the write raises
+        rows, tokens = self.rows, self.tokens
+        try:
+            apply_batch_and_insert(self.conn, rows, self.dim_cache)
+        except Exception:
+            self.rows, self.tokens, self.first_at = [], [], None
+            if self.on_failure is not None and tokens:
+                self.on_failure(tokens)
+            raise
+        self.rows, self.tokens, self.first_at = [], [], None
+        if self.on_commit is not None and tokens:
+            self.on_commit(tokens)
+
+    def run_timer(self, stop_event):
+        while not stop_event.wait(self.max_wait / 2):
+            self.flush_if_due()
+
+def build_batch_writer(cfg, conn, dim_cache=None, on_commit=None, on_failure=None):
+    bc = cfg.get("batch", {})
+    if not bc.get("enabled", False):
+        return None
+    return BatchWriter(conn, dim_cache, bc.get("max_rows", 500), bc.get("max_wait_ms", 200), on_commit, on_failure)
+
+class SpillLog:
+    # Segmented append-only log of decoded rows: <id>.log files of (length, crc32, JSON) records.
+    # Appends are fsynced in groups by run_syncer; a single drainer reads ahead of the committed
+    # cursor, which is persisted in cursor.json, and whole segments are deleted once drained
+    RECORD = struct.Struct(">II")
+
+    def __init__(self, directory, segment_bytes=64 << 20, fsync_interval_ms=50, max_bytes=0, dead_letter_path=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dead_letter_path = dead_letter_path or os.path.join(directory, "dead_letter.jsonl")
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.cond = threading.Condition()
+        self.sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(".log"):
+                self.sizes[int(name[:-4])] = os.path.getsize(os.path.join(directory, name))
+        self.committed = self._load_cursor()
+        for seg in [s for s in self.sizes if s < self.committed[0]]:
+            os.remove(self._path(seg))
+            del self.sizes[seg]
+        # Never append to a segment left by a previous run: its tail may be torn
+        self.active_id = max(self.sizes, default=0) + 1
+        self.active = open(self._path(self.active_id), "ab")
+        self.sizes[self.active_id] = 0
+        if self.committed[0] not in self.sizes:
+            self.committed = (min(self.sizes), 0)
+        self.read_pos = self.committed
+        self.reader = None
+        self.reader_seg = None
+        self.backlog = sum(size for seg, size in self.sizes.items() if seg >= self.committed[0]) - self.committed[1]
+        self.callbacks = []
+        self.dirty = False
+        if self.backlog:
+            print(f"Spill log {directory}: recovered {self.backlog} bytes to drain")
+
+    def _path(self, seg):
+        return os.path.join(self.directory, f"{seg:012d}.log")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor.json"), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return int(state["segment"]), int(state["offset"])
+        except FileNotFoundError:
+            return min(self.sizes, default=1), 0
+
+    def append(self, rows, on_durable=None):
+        data = bytearray()
+        for row in rows:
+            payload = json.dumps(row, ensure_ascii=False).encode("utf-8")
+            data += self.RECORD.pack(len(payload), zlib.crc32(payload))
+            data += payload
+        with self.cond:
+            while self.max_bytes and self.backlog > self.max_bytes:
+                self.cond.wait(0.5)
+            if data:
+                self.active.write(data)
+                self.active.flush()
+                self.sizes[self.active_id] += len(data)
+                self.backlog += len(data)
+                self.dirty = True
+            if on_durable is not None:
+                self.callbacks.append(on_durable)
+                self.dirty = True
+            if self.sizes[self.active_id] >= self.segment_bytes:
+                self._rotate_locked()
+            self.cond.notify_all()
+        metrics.inc("importer_spilled_rows_total", len(rows))
+        if not self.fsync_interval:
+            self.sync()
+
+    def _rotate_locked(self):
+        os.fsync(self.active.fileno())
+        self.active.close()
+        self.active_id += 1
+        self.active = open(self._path(self.active_id), "ab")
+        self.sizes[self.active_id] = 0
+
+    def sync(self):
+        with self.cond:
+            if not self.dirty:
+                return
+            os.fsync(self.active.fileno())
+            callbacks, self.callbacks = self.callbacks, []
+            self.dirty = False
+        for callback in callbacks:
+            callback()
+
+    def run_syncer(self, stop_event):
+        while not stop_event.wait(self.fsync_interval or 0.05):
+            self.sync()
+        self.sync()
+
+    def read_batch(self, max_rows, timeout=0.2):
+        rows = []
+        while len(rows) < max_rows:
+            seg, offset = self.read_pos
+            with self.cond:
+                end = self.sizes[seg]
+                if offset >= end and seg == self.active_id:
+                    if rows or not self.cond.wait(timeout) or self.sizes[seg] == offset:
+                        break
+                    continue
+                following = min((s for s in self.sizes if s > seg), default=None)
+            if offset >= end:
+                self.read_pos = (following, 0)
+                continue
+            if self.reader_seg != seg:
+                if self.reader is not None:
+                    self.reader.close()
+                self.reader = open(self._path(seg), "rb")
+                self.reader_seg = seg
+            self.reader.seek(offset)
+            header = self.reader.read(self.RECORD.size)
+            length, crc = self.RECORD.unpack(header) if len(header) == self.RECORD.size else (0, None)
+            payload = self.reader.read(length) if crc is not None and offset + self.RECORD.size + length <= end else b""
+            if crc is None or len(payload) != length or zlib.crc32(payload) != crc:
+                # Only a segment from before a crash can end mid-record; its torn tail is skipped
+                print(f"Spill log: skipping torn tail of segment {seg} at offset {offset}")
+                metrics.error("spill_torn_record")
+                self.read_pos = (seg, end)
+                continue
+            rows.append(json_loads(payload))
+            self.read_pos = (seg, offset + self.RECORD.size + length)
+        return rows, self.read_pos
+
+    def commit(self, pos):
+        seg, offset = pos
+        tmp = os.path.join(self.directory, "cursor.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segment": seg, "offset": offset}, f)
+        os.replace(tmp, os.path.join(self.directory, "cursor.json"))
+        with self.cond:
+            prev_seg, prev_offset = self.committed
+            drained = -prev_offset
+            for s in sorted(self.sizes):
+                if prev_seg <= s < seg:
+                    drained += self.sizes[s]
+            self.backlog -= drained + offset
+            for s in [s for s in self.sizes if s < seg]:
+                os.remove(self._path(s))
+                del self.sizes[s]
+            self.committed = pos
+            self.cond.notify_all()
+
+    def dead_letter(self, row, error):
+        line = json.dumps({"error": str(error), "row": row}, ensure_ascii=False)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        print("Spill log: row moved to dead letter file:", error)
+        metrics.inc("importer_dead_letter_rows_total")
+
+    def close(self):
+        self.sync()
+        with self.cond:
+            self.active.close()
+        if self.reader is not None:
+            self.reader.close()
+
+# Connection loss, timeouts, lock waits, read-only standbys during failover: a retry can succeed
+TRANSIENT_SQLSTATE_CLASSES = ("08", "25", "40", "53", "55", "57", "58")
+
+def is_transient_db_error(e):
+    if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        return True
+    code = getattr(e, "pgcode", None)
+    return bool(code) and code[:2] in TRANSIENT_SQLSTATE_CLASSES
+
+def commit_rows(conn, rows, dim_cache=None):
+    with conn.cursor() as cur:
+        keys = normalize_batch(cur, rows, dim_cache)
+    timed_commit(conn, dim_cache)
+    if idempotency is not None:
+        idempotency.confirm(keys)
+
+def write_spilled_rows(spill, conn, rows, dim_cache=None):
+    # Unlike apply_batch_and_insert this raises on transient errors, so the drainer retries from the
+    # same log position; a row that fails on its own for any other reason goes to the dead letter file
+    try:
+        commit_rows(conn, rows, dim_cache)
+    except Exception as e:
+        if is_transient_db_error(e):
+            raise
+        print("Spill batch failed, retrying row by row:", e)
+        metrics.error("db_batch")
+        if dim_cache is not None:
+            dim_cache.rollback(conn)
+        conn.rollback()
+        for row in rows:
+            try:
+                commit_rows(conn, [row], dim_cache)
+            except Exception as e:
+                if is_transient_db_error(e):
+                    raise
+                if dim_cache is not None:
+                    dim_cache.rollback(conn)
+                conn.rollback()
+                spill.dead_letter(row, e)
+    bump_data_version(conn)
+    metrics.inc("importer_rows_total", len(rows), path="spill")
+
+def drain_spill(spill, cfg, stop_event, batch_rows=500):
+    # Writes spilled rows to Postgres at the database's pace; a failed batch is retried from the
+    # same position, so rows leave the log only after their commit
+    dim_cache = build_dimension_cache(cfg)
+    conn = None
+    backoff = 0.5
+    rows, pos = [], None
+    while True:
+        if not rows:
+            rows, pos = spill.read_batch(batch_rows)
+            if not rows:
+                if pos != spill.committed:
+                    spill.commit(pos)
+                if stop_event.is_set():
+                    break
+                continue
+        try:
+            if conn is None or conn.closed:
+                conn = get_db_conn(dict(cfg, batch={"enabled": True}))
+            write_spilled_rows(spill, conn, rows, dim_cache)
+        except Exception as e:
+            print(f"Spill drain failed, retrying in {backoff:.1f}s:", e)
+            metrics.error("spill_drain")
+            if conn is not None:
+                if dim_cache is not None:
+                    dim_cache.rollback(conn)
+                if not conn.closed:
+                    conn.close()
+            conn = None
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        spill.commit(pos)
+        rows = []
+        backoff = 0.5
+    if conn is not None:
+        conn.close()
+
+spill_log = None
+
+def init_spill(cfg, suffix=None):
+    global spill_log
+    sc = cfg.get("spill", {})
+    if not sc.get("enabled", False):
+        spill_log = None
+        return
+    directory = sc.get("dir", "spill")
+    if suffix is not None:
+        directory = os.path.join(directory, suffix)
+    spill_log = SpillLog(directory, sc.get("segment_bytes", 64 << 20), sc.get("fsync_interval_ms", 50), sc.get("max_bytes", 0),
+                         sc.get("dead_letter_file"))
+    stop_event = threading.Event()
+    threading.Thread(target=spill_log.run_syncer, args=(stop_event,), daemon=True).start()
+    threading.Thread(target=drain_spill, args=(spill_log, cfg, stop_event, sc.get("drain_batch_rows", 500)), daemon=True).start()
+    print(f"Spill log enabled in {directory}")
+
+def socket_worker(client_sock, addr, cfg, db_conn, dim_cache=None, writer=None):
+    def store(rows):
+        if spill_log is not None:
+            spill_log.append(rows)
+            return
+        for row in rows:
+            if writer is not None:
+                writer.add(row)
+            else:
+                apply_normalization_and_insert(db_conn, row, dim_cache)
+
+    max_frame = max_frame_bytes(cfg)
     try:
-        buf = b""
+        buf = bytearray()
+        binary = None
+        decoder = None
+        scan_from = 0
         while True:
-            data = client_sock.recv(4096)
+            data = client_sock.recv(65536)
             if not data:
                 break
             buf += data
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
-                if not line.strip():
+            if binary is None:
+                if len(buf) < len(STREAM_MAGIC) and STREAM_MAGIC.startswith(bytes(buf)):
                     continue
-                row = process_message(line, cfg)
-                if row is not None:
-                    apply_normalization_and_insert(db_conn, row)
+                binary = buf.startswith(STREAM_MAGIC)
+            start = 0
+            if binary:
+                if decoder is None:
+                    parsed = parse_stream_header(buf)
+                    if parsed is None:
+                        continue
+                    header, start = parsed
+                    decoder = FrameDecoder(cfg, header)
+                for kind, body, start in iter_frames(buf, start, max_frame):
+                    store(decoder.decode(kind, body))
+                del buf[:start]
+                continue
+            # Lines are views into buf and must be dropped before buf is resized
+            view = memoryview(buf)
+            lines = []
+            while True:
+                nl = buf.find(b"\n", scan_from)
+                if nl < 0:
+                    scan_from = len(buf)
+                    break
+                if nl > start and (buf[start] not in b" \t\r" or buf[start:nl].strip()):
+                    lines.append(view[start:nl])
+                start = scan_from = nl + 1
+            rows = decode_messages(lines, cfg)
+            del lines, view
+            if rows:
+                store(rows)
+            del buf[:start]
+            scan_from -= start
     except Exception as e:
         print("Connection handling error:", e)
+        metrics.error("connection")
     finally:
         client_sock.close()
 
+def build_server_ssl_context(cfg):
+    if not cfg.get("use_tls", False):
+        return None
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=cfg.get("tls", {}).get("certfile"), keyfile=cfg.get("tls", {}).get("keyfile"))
+    return context
+
+def max_frame_bytes(cfg):
+    sc = cfg.get("socket", {})
+    return sc.get("max_frame_bytes", sc.get("max_line_bytes", 1 << 20))
+
+def import_lines_pooled(pool, lines, cfg, dim_cache=None, decoder=None):
+    if decoder is not None:
+        rows = [row for kind, body in lines for row in decoder.decode(kind, body)]
+    else:
+        rows = decode_messages(lines, cfg)
+    if not rows:
+        return
+    if spill_log is not None:
+        spill_log.append(rows)
+        return
+    batching = cfg.get("batch", {}).get("enabled", False)
+    conn = pool.getconn()
+    try:
+        conn.autocommit = not batching
+        if batching:
+            apply_batch_and_insert(conn, rows, dim_cache)
+        else:
+            for row in rows:
+                apply_normalization_and_insert(conn, row, dim_cache)
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+async def read_line(reader, timeout):
+    try:
+        return await asyncio.wait_for(reader.readline(), timeout)
+    except asyncio.TimeoutError:
+        return None
+
+async def read_frame(reader, timeout, max_frame):
+    # Only the fixed-size header read is cancellable: readexactly keeps partial data
+    # buffered, while a cancelled body read would lose the frame
+    try:
+        head = await asyncio.wait_for(reader.readexactly(FRAME_HEADER.size), timeout)
+    except asyncio.TimeoutError:
+        return None
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ValueError("Truncated frame header")
+        return b""
+    kind, length = FRAME_HEADER.unpack(head)
+    if length > max_frame:
+        raise ValueError("Frame of %d bytes exceeds max_frame_bytes" % length)
+    return kind, await reader.readexactly(length)
+
+async def read_stream_start(reader, cfg):
+    try:
+        head = await reader.readexactly(len(STREAM_MAGIC))
+    except asyncio.IncompleteReadError as e:
+        head = e.partial
+    if head != STREAM_MAGIC:
+        if head and not head.endswith(b"\n"):
+            head += await reader.readline()
+        return None, [line.rstrip(b"\r") for line in head.split(b"\n") if line.strip()]
+    rest = await reader.readexactly(STREAM_PREFIX.size - len(STREAM_MAGIC))
+    header_len = struct.unpack(">H", rest[1:])[0]
+    header, _ = parse_stream_header(head + rest + await reader.readexactly(header_len))
+    return FrameDecoder(cfg, header), []
+
+async def handle_async_client(reader, writer, cfg, pool, executor, dim_cache, limiter):
+    addr = writer.get_extra_info("peername")
+    if limiter.locked():
+        print("Connection limit reached, rejecting", addr)
+        metrics.error("connection_limit")
+        writer.close()
+        return
+    max_rows = cfg.get("batch", {}).get("max_rows", 500)
+    max_wait = cfg.get("batch", {}).get("max_wait_ms", 200) / 1000.0
+    max_frame = max_frame_bytes(cfg)
+    loop = asyncio.get_running_loop()
+    async with limiter:
+        in_flight = None
+        decoder, lines = None, []
+
+        async def settle():
+            nonlocal in_flight
+            pending, in_flight = in_flight, None
+            if pending is not None:
+                await pending
+
+        try:
+            # Binary framing is detected from the first bytes; anything else is read as JSON lines
+            decoder, lines = await read_stream_start(reader, cfg)
+            deadline = loop.time() + max_wait if lines else None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                if decoder is not None:
+                    line = await read_frame(reader, timeout, max_frame)
+                else:
+                    line = await read_line(reader, timeout)
+                if line == b"":
+                    break
+                if decoder is not None and line is not None:
+                    lines.append(line)
+                elif line is not None and line.strip():
+                    lines.append(line.rstrip(b"\r\n"))
+                if lines and deadline is None:
+                    deadline = loop.time() + max_wait
+                if lines and (line is None or len(lines) >= max_rows):
+                    # One batch in flight per connection: further reads wait for the DB, which pushes back on the sender
+                    await settle()
+                    in_flight = loop.run_in_executor(executor, import_lines_pooled, pool, lines, cfg, dim_cache, decoder)
+                    lines = []
+                    deadline = None
+        except (asyncio.LimitOverrunError, ValueError) as e:
+            print("Message exceeds max_line_bytes or is malformed, closing", addr, e)
+            metrics.error("line_too_long")
+        except Exception as e:
+            print("Connection handling error:", e)
+            metrics.error("connection")
+        finally:
+            # Messages read before EOF or before a bad message are imported all the same
+            try:
+                if lines:
+                    await settle()
+                    in_flight = loop.run_in_executor(executor, import_lines_pooled, pool, lines, cfg, dim_cache, decoder)
+                await settle()
+            except Exception as e:
+                print("Connection handling error:", e)
+                metrics.error("connection")
+            writer.close()
+
+async def serve_async(cfg):
+    sc = cfg.get("socket", {})
+    host = sc.get("host", "0.0.0.0")
+    port = sc.get("port", 9000)
+    pool_size = cfg.get("postgres", {}).get("pool_size", 4)
+    pool = get_db_pool(cfg, pool_size)
+    executor = ThreadPoolExecutor(max_workers=pool_size)
+    dim_cache = build_dimension_cache(cfg)
+    limiter = asyncio.Semaphore(sc.get("max_connections", 100))
+    context = build_server_ssl_context(cfg)
+    server = await asyncio.start_server(
+        lambda r, w: handle_async_client(r, w, cfg, pool, executor, dim_cache, limiter),
+        host,
+        port,
+        ssl=context,
+        limit=sc.get("max_line_bytes", 1 << 20)
+    )
+    print(f"Listening on {host}:{port} (tls={context is not None}, asyncio, pool={pool_size})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+        if dim_cache is not None:
+            dim_cache.log_stats()
+        pool.closeall()
+
+def run_async_socket_server(cfg):
+    asyncio.run(serve_async(cfg))
+
 def run_socket_server(cfg):
     host = cfg.get("socket", {}).get("host", "0.0.0.0")
     port = cfg.get("socket", {}).get("port", 9000)
@@ -216,6 +1785,11 @@ def run_socket_server(cfg):
     sock.listen(5)
     print(f"Listening on {host}:{port} (tls={use_tls})")
     db_conn = get_db_conn(cfg)
+    dim_cache = build_dimension_cache(cfg)
+    writer = build_batch_writer(cfg, db_conn, dim_cache)
+    stop_event = threading.Event()
+    if writer is not None:
+        threading.Thread(target=writer.run_timer, args=(stop_event,), daemon=True).start()
     try:
         while True:
             client, addr = sock.accept()
@@ -226,47 +1800,243 @@ def run_socket_server(cfg):
                     print("TLS wrap failed:", e)
                     client.close()
                     continue
-            t = threading.Thread(target=socket_worker, args=(client, addr, cfg, db_conn), daemon=True)
+            t = threading.Thread(target=socket_worker, args=(client, addr, cfg, db_conn, dim_cache, writer), daemon=True)
             t.start()
     finally:
+        stop_event.set()
+        if writer is not None:
+            writer.flush()
+        if dim_cache is not None:
+            dim_cache.log_stats()
         db_conn.close()
         sock.close()
 
-def on_rabbit_message(ch, method, properties, body, cfg, db_conn):
-    row = process_message(body, cfg)
-    if row is not None:
-        apply_normalization_and_insert(db_conn, row)
+def on_rabbit_message(ch, method, properties, body, cfg, db_conn, dim_cache=None, writer=None):
+    # Settles the delivery in every case. A body that cannot be decoded is dropped, since a redelivery
+    # would fail the same way; a failure to store the rows requeues the delivery and is re-raised so
+    # the caller replaces the database connection
+    try:
+        rows = process_body(body, cfg)
+    except Exception as e:
+        print("RabbitMQ message rejected:", e)
+        metrics.error("rabbit_message")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    if writer is not None and spill_log is None:
+        # A failed flush requeues every delivery the writer holds, this one included
+        writer.add_rows(rows, method.delivery_tag)
+        return
+    try:
+        if spill_log is not None:
+            # Acked once the rows are fsynced to the spill log; ch must be safe to call from the syncer thread
+            spill_log.append(rows, functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+            return
+        for row in rows:
+            apply_normalization_and_insert(db_conn, row, dim_cache)
+    except Exception:
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        raise
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
+def replace_db_conn(cfg, db_conn, dim_cache=None, writer=None):
+    # Deliveries that depended on the old connection have already been requeued
+    if dim_cache is not None:
+        dim_cache.rollback(db_conn)
+    if not db_conn.closed:
+        db_conn.close()
+    db_conn = get_db_conn(cfg)
+    if writer is not None:
+        writer.conn = db_conn
+    return db_conn
+
 def run_rabbit_consumer(cfg):
     url = cfg.get("rabbitmq", {}).get("url")
-    queue = cfg.get("rabbitmq", {}).get("queue", "psu_lab_queue")
+    queue_name = cfg.get("rabbitmq", {}).get("queue", "psu_lab_queue")
     if not url:
         raise RuntimeError("RabbitMQ URL not configured")
     params = pika.URLParameters(url)
     conn = pika.BlockingConnection(params)
     channel = conn.channel()
-    channel.queue_declare(queue=queue, durable=True)
+    channel.queue_declare(queue=queue_name, durable=True)
     db_conn = get_db_conn(cfg)
-    on_message = lambda ch, method, properties, body: on_rabbit_message(ch, method, properties, body, cfg, db_conn)
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=queue, on_message_callback=on_message)
-    print("RabbitMQ consumer started, queue=", queue)
+    dim_cache = build_dimension_cache(cfg)
+    ack_batch = lambda tags: channel.basic_ack(delivery_tag=tags[-1], multiple=True)
+    requeue_batch = lambda tags: channel.basic_nack(delivery_tag=tags[-1], multiple=True, requeue=True)
+    writer = build_batch_writer(cfg, db_conn, dim_cache, on_commit=ack_batch, on_failure=requeue_batch)
+    ack_channel = ThreadsafeChannel(conn, channel) if spill_log is not None else None
+
+    def on_db_error(e):
+        # Runs on the pika thread, so there is no waiting for the database here: if it cannot be
+        # reached again right away the consumer stops and the broker requeues everything unacked
+        nonlocal db_conn
+        print("Storing RabbitMQ messages failed, requeued them and reconnecting:", e)
+        metrics.error("rabbit_store")
+        db_conn = replace_db_conn(cfg, db_conn, dim_cache, writer)
+
+    def on_message(ch, method, properties, body):
+        try:
+            on_rabbit_message(ack_channel or ch, method, properties, body, cfg, db_conn, dim_cache, writer)
+        except Exception as e:
+            on_db_error(e)
+    prefetch = cfg.get("rabbitmq", {}).get("prefetch_count", writer.max_rows * 2 if writer is not None else 1)
+    channel.basic_qos(prefetch_count=prefetch)
+    channel.basic_consume(queue=queue_name, on_message_callback=on_message)
+    if writer is not None:
+        def flush_timer():
+            try:
+                writer.flush_if_due()
+            except Exception as e:
+                on_db_error(e)
+            conn.call_later(writer.max_wait / 2, flush_timer)
+        conn.call_later(writer.max_wait / 2, flush_timer)
+    print("RabbitMQ consumer started, queue=", queue_name)
     try:
         channel.start_consuming()
     finally:
+        if writer is not None and conn.is_open:
+            writer.flush()
+        if dim_cache is not None:
+            dim_cache.log_stats()
         db_conn.close()
         conn.close()
 
+class ThreadsafeChannel:
+    # pika channels belong to their connection's thread; acks from a DB worker are handed over to it
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.connection.add_callback_threadsafe(functools.partial(self.channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.connection.add_callback_threadsafe(functools.partial(self.channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue))
+
+def process_rabbit_deliveries(cfg, deliveries, channel, dim_cache=None):
+    db_conn = get_db_conn(cfg)
+    writer = build_batch_writer(
+        cfg, db_conn, dim_cache,
+        on_commit=lambda tags: channel.basic_ack(delivery_tag=tags[-1], multiple=True),
+        on_failure=lambda tags: channel.basic_nack(delivery_tag=tags[-1], multiple=True, requeue=True)
+    )
+    try:
+        while True:
+            try:
+                item = deliveries.get(timeout=writer.max_wait / 2 if writer is not None else None)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            try:
+                if item:
+                    method, properties, body = item
+                    on_rabbit_message(channel, method, properties, body, cfg, db_conn, dim_cache, writer)
+                if writer is not None:
+                    writer.flush_if_due()
+            except Exception as e:
+                # The failed deliveries are requeued; the ones still waiting in the local queue stay
+                # unacked until the database is back
+                print("Storing RabbitMQ messages failed, requeued them and reconnecting:", e)
+                metrics.error("rabbit_store")
+                db_conn = reconnect_db_conn(cfg, db_conn, dim_cache, writer)
+        if writer is not None:
+            writer.flush()
+    finally:
+        db_conn.close()
+
+def reconnect_db_conn(cfg, db_conn, dim_cache=None, writer=None):
+    backoff = 0.5
+    while True:
+        try:
+            return replace_db_conn(cfg, db_conn, dim_cache, writer)
+        except Exception as e:
+            print(f"Database reconnect failed, retrying in {backoff:.1f}s:", e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+def run_rabbit_worker(cfg, index, dim_cache=None, in_process=False):
+    # One connection, channel and DB connection per worker. The pika thread only receives and acks,
+    # so a slow insert holds back this worker's prefetch window instead of the whole queue
+    if in_process:
+        init_crypto(cfg)
+        init_partitioning(cfg)
+        init_data_version(cfg)
+        init_idempotency(cfg)
+        init_spill(cfg, f"worker-{index}")
+        # No endpoint per worker; see run_rabbit_workers
+        init_metrics(dict(cfg, metrics=dict(cfg.get("metrics", {}), http_port=0)))
+        metrics.log_prefix = f"[worker {index}] "
+        dim_cache = build_dimension_cache(cfg)
+    rc = cfg.get("rabbitmq", {})
+    queue_name = rc.get("queue", "psu_lab_queue")
+    conn = pika.BlockingConnection(pika.URLParameters(rc["url"]))
+    channel = conn.channel()
+    channel.queue_declare(queue=queue_name, durable=True)
+    max_rows = cfg.get("batch", {}).get("max_rows", 500) if cfg.get("batch", {}).get("enabled", False) else 0
+    channel.basic_qos(prefetch_count=rc.get("worker_prefetch_count", max_rows * 2 or 16))
+    deliveries = queue.Queue()
+    channel.basic_consume(queue=queue_name, on_message_callback=lambda ch, method, properties, body: deliveries.put((method, properties, body)))
+    worker = threading.Thread(target=process_rabbit_deliveries, args=(cfg, deliveries, ThreadsafeChannel(conn, channel), dim_cache), daemon=True)
+    worker.start()
+    print(f"RabbitMQ worker {index} started, queue=", queue_name)
+    try:
+        channel.start_consuming()
+    finally:
+        deliveries.put(None)
+        # Let the worker drain and hand its last acks to this thread before the connection closes
+        while worker.is_alive() and conn.is_open:
+            conn.process_data_events(time_limit=0.1)
+        if in_process and dim_cache is not None:
+            dim_cache.log_stats()
+        if conn.is_open:
+            conn.close()
+
+def run_rabbit_workers(cfg):
+    rc = cfg.get("rabbitmq", {})
+    if not rc.get("url"):
+        raise RuntimeError("RabbitMQ URL not configured")
+    consumers = rc.get("consumers", 1)
+    if rc.get("worker_mode", "thread") == "process":
+        # Metrics are per process and not aggregated: /metrics only covers thread mode
+        if metrics.enabled:
+            print("worker_mode process keeps metrics per worker: /metrics shows none of them, "
+                  "each worker only logs its own summary every metrics.log_every_sec")
+        ctx = multiprocessing.get_context("spawn")
+        workers = [ctx.Process(target=run_rabbit_worker, args=(cfg, i, None, True), daemon=True) for i in range(consumers)]
+    else:
+        dim_cache = build_dimension_cache(cfg)
+        workers = [threading.Thread(target=run_rabbit_worker, args=(cfg, i, dim_cache), daemon=True) for i in range(consumers)]
+    for w in workers:
+        w.start()
+    print(f"RabbitMQ consumers started: {consumers} ({rc.get('worker_mode', 'thread')})")
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        print("Stopping RabbitMQ consumers")
+
 # ---------------- main ----------------
 def main():
     parser = argparse.ArgumentParser(description="Importer: accept messages and insert into normalized DB")
     parser.add_argument("--config", default="importer_config.yaml")
     args = parser.parse_args()
     cfg = load_config(args.config)
+    init_crypto(cfg)
+    init_partitioning(cfg)
+    init_data_version(cfg)
+    init_metrics(cfg)
+    init_idempotency(cfg)
     mode = cfg.get("mode", "socket")
-    if mode == "socket":
+    rc = cfg.get("rabbitmq", {})
+    if not (mode == "rabbitmq" and rc.get("consumers", 1) > 1 and rc.get("worker_mode", "thread") == "process"):
+        # Worker processes open their own spill log in a per-worker subdirectory
+        init_spill(cfg)
+    if mode == "socket" and cfg.get("socket", {}).get("server") == "asyncio":
+        run_async_socket_server(cfg)
+    elif mode == "socket":
         run_socket_server(cfg)
+    elif mode == "rabbitmq" and cfg.get("rabbitmq", {}).get("consumers", 1) > 1:
+        run_rabbit_workers(cfg)
     elif mode == "rabbitmq":
         run_rabbit_consumer(cfg)
     else:
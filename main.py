@@ -1,8 +1,163 @@
+import argparse
+import io
+import multiprocessing
 import sqlite3
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
 import settings
 import numpy as np
 
+SOURCE_COLUMNS = (
+    "patient_full_name", "patient_birth_date", "doctor_full_name", "doctor_specialization",
+    "department_name", "appointment_date", "complaints", "diagnosis_name"
+)
+
+STAGING_DDL = """
+    CREATE TEMP TABLE import_staging (
+        seq BIGINT,
+        patient_name TEXT,
+        patient_dob TEXT,
+        doctor_name TEXT,
+        doctor_spec TEXT,
+        department_name TEXT,
+        app_date TEXT,
+        complaints TEXT,
+        diagnosis_name TEXT
+    ) ON COMMIT DROP
+"""
+
+MERGE_DEPARTMENTS = """
+    INSERT INTO departments (name)
+    SELECT DISTINCT department_name FROM import_staging
+    WHERE department_name IS NOT NULL
+    ON CONFLICT (name) DO NOTHING
+"""
+
+MERGE_DIAGNOSES = """
+    INSERT INTO diagnoses (name)
+    SELECT DISTINCT diagnosis_name FROM import_staging
+    WHERE diagnosis_name IS NOT NULL
+    ON CONFLICT (name) DO NOTHING
+"""
+
+MERGE_PATIENTS = """
+    INSERT INTO patients (full_name, birth_date)
+    SELECT DISTINCT ON (s.patient_name) s.patient_name, NULLIF(s.patient_dob, '')::date
+    FROM import_staging s
+    WHERE s.patient_name IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM patients p WHERE p.full_name = s.patient_name)
+    ORDER BY s.patient_name, s.seq
+    ON CONFLICT (full_name, birth_date) DO NOTHING
+"""
+
+MERGE_DOCTORS = """
+    INSERT INTO doctors (full_name, specialization, department_id)
+    SELECT DISTINCT ON (s.doctor_name) s.doctor_name, s.doctor_spec, dep.id
+    FROM import_staging s
+    LEFT JOIN departments dep ON dep.name = s.department_name
+    WHERE s.doctor_name IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM doctors d WHERE d.full_name = s.doctor_name)
+    ORDER BY s.doctor_name, s.seq
+    ON CONFLICT (full_name, specialization) DO NOTHING
+"""
+
+RESOLVE_STAGING = """
+    CREATE TEMP TABLE import_resolved ON COMMIT DROP AS
+    SELECT s.seq,
+           p.id AS patient_id,
+           d.id AS doctor_id,
+           dg.id AS diagnosis_id,
+           NULLIF(s.app_date, '')::timestamp AS appointment_date,
+           s.complaints
+    FROM import_staging s
+    JOIN LATERAL (SELECT id FROM patients WHERE full_name = s.patient_name ORDER BY id LIMIT 1) p ON true
+    JOIN LATERAL (SELECT id FROM doctors WHERE full_name = s.doctor_name ORDER BY id LIMIT 1) d ON true
+    LEFT JOIN diagnoses dg ON dg.name = s.diagnosis_name
+"""
+
+MERGE_APPOINTMENTS = """
+    INSERT INTO appointments (patient_id, doctor_id, appointment_date, complaints)
+    SELECT DISTINCT ON (patient_id, doctor_id, appointment_date)
+           patient_id, doctor_id, appointment_date, complaints
+    FROM import_resolved
+    ORDER BY patient_id, doctor_id, appointment_date, seq DESC
+    ON CONFLICT (patient_id, doctor_id, appointment_date) DO UPDATE SET complaints = EXCLUDED.complaints
+"""
+
+ENSURE_PARTITIONS = """
+    SELECT ensure_appointments_partition(month)
+    FROM (
+        SELECT DISTINCT date_trunc('month', appointment_date) AS month
+        FROM import_resolved
+        WHERE appointment_date IS NOT NULL
+    ) m
+"""
+
+ENSURE_STAGING_PARTITIONS = """
+    SELECT ensure_appointments_partition(month)
+    FROM (
+        SELECT DISTINCT date_trunc('month', NULLIF(app_date, '')::timestamp) AS month
+        FROM import_staging
+        WHERE NULLIF(app_date, '') IS NOT NULL
+    ) m
+"""
+
+# Различные значения каждого измерения и месяцы приёмов в порядке первого появления в источнике
+SEED_DIMENSIONS_QUERY = """
+    SELECT patient_name, patient_dob, doctor_name, doctor_spec, department_name, app_month, NULL, diagnosis_name
+    FROM (
+        SELECT MIN(rowid) AS first_row, patient_full_name AS patient_name, patient_birth_date AS patient_dob,
+               NULL AS doctor_name, NULL AS doctor_spec, NULL AS department_name, NULL AS app_month,
+               NULL AS diagnosis_name
+        FROM hospital_records GROUP BY 2, 3
+        UNION ALL
+        SELECT MIN(rowid), NULL, NULL, doctor_full_name, doctor_specialization, department_name, NULL, NULL
+        FROM hospital_records GROUP BY 4, 5, 6
+        UNION ALL
+        SELECT MIN(rowid), NULL, NULL, NULL, NULL, NULL, NULL, diagnosis_name
+        FROM hospital_records GROUP BY 8
+        UNION ALL
+        SELECT MIN(rowid), NULL, NULL, NULL, NULL, NULL, substr(appointment_date, 1, 7) || '-01', NULL
+        FROM hospital_records WHERE appointment_date <> '' GROUP BY 7
+    )
+    ORDER BY first_row
+"""
+
+# Выполняется после commit: кэш отчётов считает записи старше этой версии устаревшими
+BUMP_DATA_VERSION = "SELECT nextval('import_data_version')"
+data_version_enabled = True
+
+MERGE_APPOINTMENT_DIAGNOSES = """
+    INSERT INTO appointment_diagnoses (appointment_id, diagnosis_id)
+    SELECT DISTINCT a.id, r.diagnosis_id
+    FROM import_resolved r
+    JOIN appointments a
+      ON a.patient_id = r.patient_id
+     AND a.doctor_id = r.doctor_id
+     AND a.appointment_date = r.appointment_date
+    WHERE r.diagnosis_id IS NOT NULL
+    ON CONFLICT DO NOTHING
+"""
+
+
+def bump_data_version(pg_con):
+    # Без миграции 005 последовательности нет. Данные к этому моменту уже закоммичены,
+    # поэтому импорт не падает: предупреждаем один раз и больше не пытаемся
+    global data_version_enabled
+    if not data_version_enabled:
+        return
+    cur = pg_con.cursor()
+    try:
+        cur.execute(BUMP_DATA_VERSION)
+        pg_con.commit()
+    except psycopg2.errors.UndefinedTable:
+        pg_con.rollback()
+        data_version_enabled = False
+        print("Sequence import_data_version is missing (apply migrations/005), report cache versioning disabled")
+    finally:
+        cur.close()
+
 
 def get_data(cursor, table, column, value):
     cursor.execute(f"SELECT id FROM {table} WHERE {column} = %s", (value,))
@@ -32,8 +187,8 @@ def get_data_multi(cursor, table, search_fields: dict, insert_fields: dict):
         return cursor.fetchone()[0]
 
 
-def import_data():
-    sqlite_con = sqlite3.connect('hospital_denormalized.db')
+def import_data(sqlite_path='hospital_denormalized.db'):
+    sqlite_con = sqlite3.connect(sqlite_path)
     sqlite_cur = sqlite_con.cursor()
 
     pg_con = psycopg2.connect(**settings.config)
@@ -42,6 +197,7 @@ def import_data():
     sqlite_cur.execute("SELECT * FROM hospital_records")
     records = sqlite_cur.fetchall()
     structured_records = np.array(records, dtype=settings.dtype)
+    known_months = set()
 
     for record in structured_records:
         department_id = get_data(pg_cur, 'departments', 'name', record["department_name"])
@@ -62,6 +218,9 @@ def import_data():
                 "department_id": department_id,
             }
         )
+        if settings.partitioned_appointments and record["app_date"][:7] not in known_months:
+            pg_cur.execute("SELECT ensure_appointments_partition(%s)", (record["app_date"],))
+            known_months.add(record["app_date"][:7])
         pg_cur.execute(
             "SELECT id FROM appointments WHERE patient_id = %s AND doctor_id = %s AND appointment_date = %s",
             (patient_id, doctor_id, record["app_date"])
@@ -92,10 +251,222 @@ def import_data():
             )
 
     pg_con.commit()
+    bump_data_version(pg_con)
     pg_cur.close()
     pg_con.close()
     sqlite_cur.close()
     sqlite_con.close()
 
 
-import_data()
+def copy_text_field(value):
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_line(seq, record):
+    return "\t".join([str(seq)] + [copy_text_field(v) for v in record])
+
+
+class SqliteCopyStream:
+    # Файлоподобный адаптер: отдаёт строки SQLite в COPY ... FROM STDIN, не загружая всю таблицу в память
+    def __init__(self, cursor, chunk_rows=5000):
+        self.cursor = cursor
+        self.chunk_rows = chunk_rows
+        self.buf = bytearray()
+        self.seq = 0
+        self.rows = 0
+
+    def _fill(self):
+        batch = self.cursor.fetchmany(self.chunk_rows)
+        if not batch:
+            return False
+        lines = []
+        for record in batch:
+            self.seq += 1
+            lines.append(copy_line(self.seq, record))
+        self.rows += len(batch)
+        self.buf += ("\n".join(lines) + "\n").encode("utf-8")
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            size = len(self.buf)
+        while len(self.buf) < size and self._fill():
+            pass
+        chunk = bytes(self.buf[:size])
+        del self.buf[:size]
+        return chunk
+
+    def readline(self, size=-1):
+        while b"\n" not in self.buf and self._fill():
+            pass
+        idx = self.buf.find(b"\n")
+        end = len(self.buf) if idx < 0 else idx + 1
+        line = bytes(self.buf[:end])
+        del self.buf[:end]
+        return line
+
+
+def import_data_bulk(sqlite_path='hospital_denormalized.db', chunk_rows=5000):
+    sqlite_con = sqlite3.connect(sqlite_path)
+    sqlite_cur = sqlite_con.cursor()
+    sqlite_cur.execute(f"SELECT {', '.join(SOURCE_COLUMNS)} FROM hospital_records")
+
+    pg_con = psycopg2.connect(**settings.config)
+    pg_cur = pg_con.cursor()
+    try:
+        pg_cur.execute(STAGING_DDL)
+        stream = SqliteCopyStream(sqlite_cur, chunk_rows)
+        pg_cur.copy_expert("COPY import_staging FROM STDIN", stream, size=65536)
+        pg_cur.execute("ANALYZE import_staging")
+        for statement in (MERGE_DEPARTMENTS, MERGE_DIAGNOSES, MERGE_PATIENTS, MERGE_DOCTORS, RESOLVE_STAGING):
+            pg_cur.execute(statement)
+        pg_cur.execute("ANALYZE import_resolved")
+        if settings.partitioned_appointments:
+            pg_cur.execute(ENSURE_PARTITIONS)
+        pg_cur.execute(MERGE_APPOINTMENTS)
+        pg_cur.execute(MERGE_APPOINTMENT_DIAGNOSES)
+        pg_con.commit()
+        bump_data_version(pg_con)
+        print(f"Bulk import finished: {stream.rows} source rows")
+    except Exception:
+        pg_con.rollback()
+        raise
+    finally:
+        pg_cur.close()
+        pg_con.close()
+        sqlite_cur.close()
+        sqlite_con.close()
+
+
+def seed_dimensions(sqlite_con, pg_con, chunk_rows=5000):
+    sqlite_cur = sqlite_con.cursor()
+    sqlite_cur.execute(SEED_DIMENSIONS_QUERY)
+    pg_cur = pg_con.cursor()
+    try:
+        pg_cur.execute(STAGING_DDL)
+        stream = SqliteCopyStream(sqlite_cur, chunk_rows)
+        pg_cur.copy_expert("COPY import_staging FROM STDIN", stream, size=65536)
+        pg_cur.execute("ANALYZE import_staging")
+        for statement in (MERGE_DEPARTMENTS, MERGE_DIAGNOSES, MERGE_PATIENTS, MERGE_DOCTORS):
+            pg_cur.execute(statement)
+        if settings.partitioned_appointments:
+            pg_cur.execute(ENSURE_STAGING_PARTITIONS)
+        pg_con.commit()
+        return stream.rows
+    except Exception:
+        pg_con.rollback()
+        raise
+    finally:
+        pg_cur.close()
+        sqlite_cur.close()
+
+
+_worker_conn = None
+
+
+def _open_worker_connection():
+    global _worker_conn
+    _worker_conn = psycopg2.connect(**settings.config)
+
+
+def import_partition_chunk(rows):
+    # Выполняется в процессе-воркере. Справочники уже заполнены, поэтому пачка затрагивает
+    # только приёмы, у которых хэш (patient, doctor) попадает в её секцию
+    data = ("\n".join(copy_line(record[0], record[1:]) for record in rows) + "\n").encode("utf-8")
+    cur = _worker_conn.cursor()
+    try:
+        cur.execute(STAGING_DDL)
+        cur.copy_expert("COPY import_staging FROM STDIN", io.BytesIO(data), size=65536)
+        cur.execute("ANALYZE import_staging")
+        cur.execute(RESOLVE_STAGING)
+        cur.execute("ANALYZE import_resolved")
+        cur.execute(MERGE_APPOINTMENTS)
+        cur.execute(MERGE_APPOINTMENT_DIAGNOSES)
+        _worker_conn.commit()
+        bump_data_version(_worker_conn)
+    except Exception:
+        _worker_conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(rows)
+
+
+def partition_of(record, partitions):
+    key = f"{record[0]}\x1f{record[2]}".encode("utf-8")
+    return zlib.crc32(key) % partitions
+
+
+def import_data_parallel(sqlite_path='hospital_denormalized.db', workers=4, chunk_rows=5000):
+    sqlite_con = sqlite3.connect(sqlite_path)
+    pg_con = psycopg2.connect(**settings.config)
+    try:
+        seeded = seed_dimensions(sqlite_con, pg_con, chunk_rows)
+    finally:
+        pg_con.close()
+    print(f"Dimensions seeded from {seeded} distinct values")
+
+    sqlite_cur = sqlite_con.cursor()
+    sqlite_cur.execute(f"SELECT {', '.join(SOURCE_COLUMNS)} FROM hospital_records ORDER BY rowid")
+    buffers = [[] for _ in range(workers)]
+    pending = {}
+    imported = 0
+    seq = 0
+
+    # У секции одновременно в работе не больше одной пачки: строки одной пары (patient, doctor)
+    # сливаются в порядке источника, и два воркера никогда не обновляют один и тот же приём
+    def submit(partition):
+        nonlocal imported
+        previous = pending.get(partition)
+        if previous is not None:
+            imported += previous.result()
+        pending[partition] = pool.submit(import_partition_chunk, buffers[partition])
+        buffers[partition] = []
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_open_worker_connection) as pool:
+            while True:
+                batch = sqlite_cur.fetchmany(chunk_rows)
+                if not batch:
+                    break
+                for record in batch:
+                    seq += 1
+                    buffers[partition_of(record, workers)].append((seq,) + tuple(record))
+                for partition in range(workers):
+                    if len(buffers[partition]) >= chunk_rows:
+                        submit(partition)
+            for partition in range(workers):
+                if buffers[partition]:
+                    submit(partition)
+            for future in pending.values():
+                imported += future.result()
+    finally:
+        sqlite_cur.close()
+        sqlite_con.close()
+    print(f"Parallel import finished: {imported} source rows, {workers} workers")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import denormalized SQLite records into the normalized DB")
+    parser.add_argument("--sqlite", default="hospital_denormalized.db")
+    parser.add_argument("--mode", choices=("row", "bulk", "parallel"), default="row")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4, help="worker processes for --mode parallel")
+    args = parser.parse_args()
+    if args.mode == "parallel":
+        import_data_parallel(args.sqlite, args.workers, args.chunk_rows)
+    elif args.mode == "bulk":
+        import_data_bulk(args.sqlite, args.chunk_rows)
+    else:
+        import_data(args.sqlite)
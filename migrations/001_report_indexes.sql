@@ -0,0 +1,6 @@
+-- Индексы для отчётов на уже существующей базе (см. setup_normalized_db.sql).
+-- CONCURRENTLY не блокирует запись импортёров; выполняется вне транзакции.
+-- На секционированной appointments CONCURRENTLY недоступен: setup_db.py выполняет там обычный CREATE INDEX.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_doctors_department_id ON doctors (department_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_appointment_date ON appointments (appointment_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_doctor_date ON appointments (doctor_id, appointment_date);
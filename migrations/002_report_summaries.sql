@@ -0,0 +1,38 @@
+-- Сводные материализованные представления для уже существующей базы (см. setup_normalized_db.sql).
+CREATE MATERIALIZED VIEW IF NOT EXISTS report_daily_departments AS
+SELECT a.appointment_date::date AS day,
+       dep.id AS department_id,
+       dep.name AS department_name,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON dep.id = COALESCE(a.department_id, d.department_id)
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS report_daily_doctors AS
+SELECT a.appointment_date::date AS day,
+       d.id AS doctor_id,
+       d.full_name AS doctor_name,
+       d.specialization,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN doctors d ON a.doctor_id = d.id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3, 4;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS report_daily_diagnoses AS
+SELECT a.appointment_date::date AS day,
+       dg.id AS diagnosis_id,
+       dg.name AS diagnosis_name,
+       COUNT(*) AS appointments
+FROM appointment_diagnoses ad
+JOIN appointments a ON a.id = ad.appointment_id
+JOIN diagnoses dg ON dg.id = ad.diagnosis_id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3;
+
+-- Уникальные индексы обязательны для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_report_daily_departments ON report_daily_departments (day, department_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_report_daily_doctors ON report_daily_doctors (day, doctor_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_report_daily_diagnoses ON report_daily_diagnoses (day, diagnosis_id);
@@ -0,0 +1,22 @@
+-- Функция создания секций appointments для уже существующей базы (см. setup_normalized_db.sql).
+CREATE OR REPLACE FUNCTION ensure_appointments_partition(ts TIMESTAMP) RETURNS VOID AS $$
+DECLARE
+    month_start DATE;
+BEGIN
+    IF ts IS NULL OR NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'appointments'::regclass
+    ) THEN
+        RETURN;
+    END IF;
+    month_start := date_trunc('month', ts)::date;
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF appointments FOR VALUES FROM (%L) TO (%L)',
+        'appointments_' || to_char(month_start, 'YYYY_MM'),
+        month_start,
+        (month_start + INTERVAL '1 month')::date
+    );
+EXCEPTION WHEN duplicate_table OR unique_violation THEN
+    -- секцию параллельно создал другой импортёр
+    NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,5 @@
+-- Ключи уже импортированных сообщений для проверки дублей в importer.py.
+CREATE TABLE IF NOT EXISTS import_seen_keys (
+    key BYTEA PRIMARY KEY,
+    seen_at TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,2 @@
+-- Версия данных для кэша отчётов create_report.py (см. setup_normalized_db.sql).
+CREATE SEQUENCE IF NOT EXISTS import_data_version;
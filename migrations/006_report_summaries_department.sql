@@ -0,0 +1,48 @@
+-- Сводки считают отделение по врачу, как подробный отчёт create_report.py, а не по appointments.department_id.
+DROP MATERIALIZED VIEW IF EXISTS report_daily_departments;
+DROP MATERIALIZED VIEW IF EXISTS report_daily_doctors;
+DROP MATERIALIZED VIEW IF EXISTS report_daily_diagnoses;
+
+CREATE MATERIALIZED VIEW report_daily_departments AS
+SELECT a.appointment_date::date AS day,
+       dep.id AS department_id,
+       dep.name AS department_name,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN patients p ON a.patient_id = p.id
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON d.department_id = dep.id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3;
+
+CREATE MATERIALIZED VIEW report_daily_doctors AS
+SELECT a.appointment_date::date AS day,
+       d.id AS doctor_id,
+       d.full_name AS doctor_name,
+       d.specialization,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN patients p ON a.patient_id = p.id
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON d.department_id = dep.id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3, 4;
+
+CREATE MATERIALIZED VIEW report_daily_diagnoses AS
+SELECT a.appointment_date::date AS day,
+       dg.id AS diagnosis_id,
+       dg.name AS diagnosis_name,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN patients p ON a.patient_id = p.id
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON d.department_id = dep.id
+JOIN appointment_diagnoses ad ON ad.appointment_id = a.id
+JOIN diagnoses dg ON dg.id = ad.diagnosis_id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3;
+
+-- Уникальные индексы обязательны для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX idx_report_daily_departments ON report_daily_departments (day, department_id);
+CREATE UNIQUE INDEX idx_report_daily_doctors ON report_daily_doctors (day, doctor_id);
+CREATE UNIQUE INDEX idx_report_daily_diagnoses ON report_daily_diagnoses (day, diagnosis_id);
@@ -0,0 +1,34 @@
+-- Секционированная по месяцам таблица приёмов.
+-- Выполняется после setup_normalized_db.sql, если settings.partitioned_appointments = True.
+DROP MATERIALIZED VIEW IF EXISTS report_daily_departments;
+DROP MATERIALIZED VIEW IF EXISTS report_daily_doctors;
+DROP MATERIALIZED VIEW IF EXISTS report_daily_diagnoses;
+DROP TABLE IF EXISTS appointment_diagnoses;
+DROP TABLE IF EXISTS appointments;
+
+-- Ключ секционирования обязан входить в первичный и уникальные ключи,
+-- поэтому приёмы без даты в этом режиме не принимаются.
+-- Месячные секции создаёт ensure_appointments_partition при первой записи месяца.
+CREATE TABLE appointments (
+    id SERIAL,
+    patient_id INTEGER REFERENCES patients(id),
+    doctor_id INTEGER REFERENCES doctors(id),
+    department_id INTEGER REFERENCES departments(id),
+    appointment_date TIMESTAMP,
+    complaints TEXT,
+    PRIMARY KEY (id, appointment_date),
+    CONSTRAINT unique_appointment_key UNIQUE (patient_id, doctor_id, appointment_date)
+) PARTITION BY RANGE (appointment_date);
+
+-- Внешний ключ на appointments(id) невозможен: id уникален только вместе с appointment_date
+CREATE TABLE appointment_diagnoses (
+    appointment_id INTEGER,
+    diagnosis_id INTEGER REFERENCES diagnoses(id),
+    PRIMARY KEY (appointment_id, diagnosis_id)
+);
+
+CREATE INDEX idx_appointments_id ON appointments (id);
+CREATE INDEX idx_appointments_appointment_date ON appointments (appointment_date);
+CREATE INDEX idx_appointments_doctor_date ON appointments (doctor_id, appointment_date);
+
+SELECT nextval('import_data_version');
@@ -10,4 +10,14 @@ dtype = [
     ('patient_name', 'U50'), ('patient_dob', 'U10'), ('doctor_name', 'U50'),
     ('doctor_spec', 'U50'), ('department_name', 'U50'), ('app_date', 'U20'),
     ('complaints', 'U100'), ('diagnosis_name', 'U50')
-]
\ No newline at end of file
+]
+
+# Секционировать appointments по месяцам (setup_db.py, main.py)
+partitioned_appointments = False
+
+# Кэш готовых отчётов create_report.py: ключ — фильтры, формат и версия данных import_data_version
+report_cache = {
+    "enabled": True,
+    "dir": ".report_cache",
+    "max_bytes": 512 * 1024 * 1024,
+}
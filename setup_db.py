@@ -1,15 +1,104 @@
+import argparse
+import glob
+import os
+import re
 import psycopg2
 import settings
 
-def create_tables():
-    with open('setup_normalized_db.sql', encoding='utf-8') as f:
-        sql_script = f.read()
+MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+def migration_paths(directory='migrations'):
+    return sorted(glob.glob(os.path.join(directory, '*.sql')))
+
+def create_tables(partitioned=False):
+    scripts = ['setup_normalized_db.sql']
+    if partitioned:
+        # The summary views depend on appointments and are recreated on top of the partitioned table
+        scripts += ['partitioned_appointments.sql', os.path.join('migrations', '006_report_summaries_department.sql')]
 
     conn = psycopg2.connect(**settings.config)
     cur = conn.cursor()
-    cur.execute(sql_script)
+    for path in scripts:
+        with open(path, encoding='utf-8') as f:
+            cur.execute(f.read())
+    # A fresh schema already contains everything the migrations add
+    cur.execute(MIGRATIONS_DDL)
+    cur.execute("DELETE FROM schema_migrations")
+    for path in migration_paths():
+        cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (os.path.basename(path),))
     conn.commit()
     cur.close()
     conn.close()
 
-create_tables()
+def split_statements(sql_script):
+    lines = [line for line in sql_script.splitlines() if not line.strip().startswith('--')]
+    statements = []
+    current = []
+    in_dollar_quote = False
+    for chunk in '\n'.join(lines).split('$$'):
+        if in_dollar_quote:
+            current.append(chunk)
+        else:
+            parts = chunk.split(';')
+            for part in parts[:-1]:
+                current.append(part)
+                statements.append('$$'.join(current).strip())
+                current = []
+            current.append(parts[-1])
+        in_dollar_quote = not in_dollar_quote
+    statements.append('$$'.join(current).strip())
+    return [stmt for stmt in statements if stmt]
+
+CONCURRENT_INDEX = re.compile(
+    r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?\S+\s+ON\s+(?:ONLY\s+)?([\w."]+)',
+    re.IGNORECASE
+)
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", (table,))
+    return cur.fetchone()[0]
+
+def adapt_statement(cur, statement):
+    # Postgres refuses CREATE INDEX CONCURRENTLY on a partitioned table (settings.partitioned_appointments);
+    # a plain CREATE INDEX there builds the index on every partition, blocking writes meanwhile
+    match = CONCURRENT_INDEX.match(statement)
+    if match and is_partitioned(cur, match.group(1)):
+        return re.sub(r'\s+CONCURRENTLY\b', '', statement, count=1, flags=re.IGNORECASE)
+    return statement
+
+def apply_migrations(directory='migrations'):
+    conn = psycopg2.connect(**settings.config)
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(MIGRATIONS_DDL)
+    cur.execute("SELECT name FROM schema_migrations")
+    applied = {name for (name,) in cur.fetchall()}
+    for path in migration_paths(directory):
+        name = os.path.basename(path)
+        if name in applied:
+            continue
+        with open(path, encoding='utf-8') as f:
+            statements = split_statements(f.read())
+        for statement in statements:
+            cur.execute(adapt_statement(cur, statement))
+        # Recorded only once every statement has run; a migration that failed halfway is rerun
+        # whole, which its IF [NOT] EXISTS clauses allow
+        cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+        print(f"Applied {path}")
+    cur.close()
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the normalized schema or migrate an existing one")
+    parser.add_argument("--migrate", action="store_true", help="apply migrations/*.sql not yet listed in schema_migrations")
+    args = parser.parse_args()
+    if args.migrate:
+        apply_migrations()
+    else:
+        create_tables(getattr(settings, 'partitioned_appointments', False))
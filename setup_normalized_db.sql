@@ -1,3 +1,7 @@
+DROP MATERIALIZED VIEW IF EXISTS report_daily_departments;
+DROP MATERIALIZED VIEW IF EXISTS report_daily_doctors;
+DROP MATERIALIZED VIEW IF EXISTS report_daily_diagnoses;
+DROP TABLE IF EXISTS import_seen_keys;
 DROP TABLE IF EXISTS appointment_diagnoses;
 DROP TABLE IF EXISTS appointments;
 DROP TABLE IF EXISTS doctors;
@@ -51,4 +55,91 @@ CREATE TABLE appointment_diagnoses (
     appointment_id INTEGER REFERENCES appointments(id),
     diagnosis_id INTEGER REFERENCES diagnoses(id),
     PRIMARY KEY (appointment_id, diagnosis_id)
-);
\ No newline at end of file
+);
+
+-- Версия данных для кэша отчётов create_report.py: импортёры вызывают nextval после каждого commit.
+-- Последовательность переживает пересоздание схемы, чтобы старые записи кэша не совпали с новыми версиями.
+CREATE SEQUENCE IF NOT EXISTS import_data_version;
+SELECT nextval('import_data_version');
+
+-- Ключи уже импортированных сообщений: из них importer.py при старте заполняет фильтр Блума
+CREATE TABLE import_seen_keys (
+    key BYTEA PRIMARY KEY,
+    seen_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Индексы для фильтров и соединений в create_report.py.
+-- Поиск по patients.full_name и doctors.full_name уже покрывают уникальные
+-- ограничения (full_name идёт первым столбцом), отдельные индексы не нужны.
+CREATE INDEX idx_doctors_department_id ON doctors (department_id);
+CREATE INDEX idx_appointments_appointment_date ON appointments (appointment_date);
+CREATE INDEX idx_appointments_doctor_date ON appointments (doctor_id, appointment_date);
+
+-- Сводки по дням для create_report.create_summary_report (обновляются только через refresh_summaries).
+-- Соединения те же, что в подробном отчёте: отделение приёма — отделение врача.
+CREATE MATERIALIZED VIEW report_daily_departments AS
+SELECT a.appointment_date::date AS day,
+       dep.id AS department_id,
+       dep.name AS department_name,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN patients p ON a.patient_id = p.id
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON d.department_id = dep.id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3;
+
+CREATE MATERIALIZED VIEW report_daily_doctors AS
+SELECT a.appointment_date::date AS day,
+       d.id AS doctor_id,
+       d.full_name AS doctor_name,
+       d.specialization,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN patients p ON a.patient_id = p.id
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON d.department_id = dep.id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3, 4;
+
+CREATE MATERIALIZED VIEW report_daily_diagnoses AS
+SELECT a.appointment_date::date AS day,
+       dg.id AS diagnosis_id,
+       dg.name AS diagnosis_name,
+       COUNT(*) AS appointments
+FROM appointments a
+JOIN patients p ON a.patient_id = p.id
+JOIN doctors d ON a.doctor_id = d.id
+JOIN departments dep ON d.department_id = dep.id
+JOIN appointment_diagnoses ad ON ad.appointment_id = a.id
+JOIN diagnoses dg ON dg.id = ad.diagnosis_id
+WHERE a.appointment_date IS NOT NULL
+GROUP BY 1, 2, 3;
+
+-- Уникальные индексы обязательны для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX idx_report_daily_departments ON report_daily_departments (day, department_id);
+CREATE UNIQUE INDEX idx_report_daily_doctors ON report_daily_doctors (day, doctor_id);
+CREATE UNIQUE INDEX idx_report_daily_diagnoses ON report_daily_diagnoses (day, diagnosis_id);
+
+-- Создание месячной секции appointments по требованию (ничего не делает для обычной таблицы)
+CREATE OR REPLACE FUNCTION ensure_appointments_partition(ts TIMESTAMP) RETURNS VOID AS $$
+DECLARE
+    month_start DATE;
+BEGIN
+    IF ts IS NULL OR NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'appointments'::regclass
+    ) THEN
+        RETURN;
+    END IF;
+    month_start := date_trunc('month', ts)::date;
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF appointments FOR VALUES FROM (%L) TO (%L)',
+        'appointments_' || to_char(month_start, 'YYYY_MM'),
+        month_start,
+        (month_start + INTERVAL '1 month')::date
+    );
+EXCEPTION WHEN duplicate_table OR unique_violation THEN
+    -- секцию параллельно создал другой импортёр
+    NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,85 @@
+import json
+import zlib
+
+import pytest
+
+import importer
+
+CFG = {}
+
+
+def stream_header(**header):
+    header = dict({"source_table": "medical_records", "scheme": "plain", "compression": "none"}, **header)
+    body = json.dumps(header).encode("utf-8")
+    return importer.STREAM_PREFIX.pack(importer.STREAM_MAGIC, importer.STREAM_VERSION, len(body)) + body
+
+
+def frame(body, kind=importer.FRAME_ROWS):
+    return importer.FRAME_HEADER.pack(kind, len(body)) + body
+
+
+def rows_frame(rows, codec=None):
+    body = json.dumps(rows).encode("utf-8")
+    if codec == "zlib":
+        body = zlib.compress(body)
+    return frame(body)
+
+
+def test_stream_header_needs_whole_prefix_and_header():
+    data = stream_header()
+    assert importer.parse_stream_header(data[:importer.STREAM_PREFIX.size - 1]) is None
+    assert importer.parse_stream_header(data[:-1]) is None
+    header, pos = importer.parse_stream_header(data + b"rest")
+    assert header["source_table"] == "medical_records"
+    assert pos == len(data)
+
+
+def test_stream_header_rejects_other_magic_and_versions():
+    with pytest.raises(ValueError):
+        importer.parse_stream_header(b"JSON" + stream_header()[4:])
+    with pytest.raises(ValueError):
+        importer.parse_stream_header(importer.STREAM_PREFIX.pack(importer.STREAM_MAGIC, importer.STREAM_VERSION + 1, 0))
+
+
+def test_iter_frames_stops_before_truncated_frame():
+    first, second = frame(b"[1]"), frame(b"[2, 3]")
+    data = first + second
+    for cut in range(len(first), len(data)):
+        frames = list(importer.iter_frames(data[:cut]))
+        assert [body for _, body, _ in frames] == [b"[1]"]
+        assert frames[-1][2] == len(first)
+    assert [end for _, _, end in importer.iter_frames(data)] == [len(first), len(data)]
+
+
+def test_iter_frames_rejects_oversize_frame_from_header_alone():
+    # Only the header has arrived: the length check must not wait for the body
+    header = importer.FRAME_HEADER.pack(importer.FRAME_ROWS, 1025)
+    with pytest.raises(ValueError):
+        list(importer.iter_frames(header, max_frame_bytes=1024))
+    assert list(importer.iter_frames(frame(b"x" * 1024), max_frame_bytes=1024))
+
+
+def test_process_body_decodes_compressed_frames():
+    data = stream_header(compression="zlib") + rows_frame([{"a": 1}], "zlib") + rows_frame([{"a": 2}, {"a": 3}], "zlib")
+    assert importer.process_body(data, CFG) == [{"a": 1}, {"a": 2}, {"a": 3}]
+
+
+def test_process_body_rejects_truncated_message():
+    data = stream_header() + rows_frame([{"a": 1}])
+    with pytest.raises(ValueError):
+        importer.process_body(data[:-1], CFG)
+    with pytest.raises(ValueError):
+        importer.process_body(stream_header()[:-1], CFG)
+
+
+def test_process_body_refuses_custom_session():
+    with pytest.raises(RuntimeError):
+        importer.process_body(stream_header(scheme="custom_session") + rows_frame([]), CFG)
+
+
+def test_frame_decoder_rejects_unknown_kind_and_compression():
+    decoder = importer.FrameDecoder(CFG, {"scheme": "plain"})
+    with pytest.raises(RuntimeError):
+        decoder.decode(99, b"[]")
+    with pytest.raises(RuntimeError):
+        importer.FrameDecoder(CFG, {"scheme": "plain", "compression": "lz4"})
@@ -0,0 +1,98 @@
+import importer
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.found = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, vars=None):
+        self.conn.queries.append(vars)
+        self.found = vars[0] in self.conn.stored
+
+    def fetchone(self):
+        return (1,) if self.found else None
+
+
+class FakeConn:
+    closed = False
+
+    def __init__(self, stored=()):
+        self.stored = set(stored)
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def make_filter(stored=(), capacity=1000, fp_rate=0.01, recent_size=100):
+    filt = importer.IdempotencyFilter({}, capacity, fp_rate, recent_size)
+    filt.conn = FakeConn(stored)
+    return filt
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = importer.BloomFilter(1000, 0.01)
+    keys = [importer.row_key({"n": i}) for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(importer.row_key({"m": i}) in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_row_key_ignores_key_order():
+    assert importer.row_key({"a": 1, "b": "x"}) == importer.row_key({"b": "x", "a": 1})
+    assert importer.row_key({"a": 1}) != importer.row_key({"a": 2})
+
+
+def test_unseen_key_skips_the_database():
+    filt = make_filter()
+    assert not filt.is_duplicate(importer.row_key({"n": 1}))
+    assert filt.conn.queries == []
+
+
+def test_confirmed_key_is_answered_from_recent_keys():
+    filt = make_filter()
+    key = importer.row_key({"n": 1})
+    filt.confirm([key])
+    assert filt.is_duplicate(key)
+    assert filt.conn.queries == []
+
+
+def test_bloom_hit_outside_recent_keys_is_checked_in_the_table():
+    key = importer.row_key({"n": 1})
+    filt = make_filter(stored=[key], recent_size=1)
+    filt.confirm([key, importer.row_key({"n": 2})])
+    # The second key pushed the first out of the LRU; the table still has it
+    assert filt.is_duplicate(key)
+    assert filt.conn.queries == [(key,)]
+    assert filt.is_duplicate(key)
+    assert len(filt.conn.queries) == 1
+
+
+def test_bloom_false_positive_lets_the_row_through(monkeypatch):
+    metrics = importer.Metrics()
+    metrics.enabled = True
+    monkeypatch.setattr(importer, "metrics", metrics)
+    key = importer.row_key({"n": 1})
+    filt = make_filter()
+    filt.bloom.add(key)
+    assert not filt.is_duplicate(key)
+    assert filt.conn.queries == [(key,)]
+    assert metrics.counters == {("importer_idempotency_false_positives_total", ()): 1}
+
+
+def test_drop_duplicates_keeps_only_fresh_rows(monkeypatch):
+    filt = make_filter()
+    filt.confirm([importer.row_key({"n": 1})])
+    monkeypatch.setattr(importer, "idempotency", filt)
+    assert importer.drop_duplicates([{"n": 1}, {"n": 2}]) == [{"n": 2}]
+    monkeypatch.setattr(importer, "idempotency", None)
+    assert importer.drop_duplicates([{"n": 1}]) == [{"n": 1}]
@@ -0,0 +1,93 @@
+import os
+
+import importer
+
+ROWS = [{"n": i, "complaints": "Кашель"} for i in range(5)]
+
+
+def open_log(directory, **kwargs):
+    kwargs.setdefault("fsync_interval_ms", 0)
+    return importer.SpillLog(str(directory), **kwargs)
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+
+
+def test_rows_survive_a_restart(tmp_path):
+    log = open_log(tmp_path)
+    log.append(ROWS)
+    log.close()
+
+    log = open_log(tmp_path)
+    assert log.backlog > 0
+    # The segment from the previous run is never appended to again
+    assert log.active_id == 2
+    rows, _ = log.read_batch(100, timeout=0.01)
+    assert rows == ROWS
+    log.close()
+
+
+def test_torn_tail_is_skipped(tmp_path):
+    log = open_log(tmp_path)
+    log.append(ROWS)
+    log.close()
+    path = os.path.join(tmp_path, segments(tmp_path)[0])
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    log = open_log(tmp_path)
+    rows, _ = log.read_batch(100, timeout=0.01)
+    assert rows == ROWS[:-1]
+    log.append([{"n": 5}])
+    rows, _ = log.read_batch(100, timeout=0.01)
+    assert rows == [{"n": 5}]
+    log.close()
+
+
+def test_committed_cursor_survives_a_restart(tmp_path):
+    log = open_log(tmp_path, segment_bytes=1)
+    for row in ROWS:
+        log.append([row])
+    rows, pos = log.read_batch(3, timeout=0.01)
+    assert rows == ROWS[:3]
+    log.commit(pos)
+    # One row per segment: segments before the cursor's are deleted on commit
+    assert segments(tmp_path)[0] == "%012d.log" % pos[0]
+    assert pos[0] == 3
+    log.close()
+
+    log = open_log(tmp_path)
+    rows, pos = log.read_batch(100, timeout=0.01)
+    assert rows == ROWS[3:]
+    log.commit(pos)
+    assert log.backlog == 0
+    log.close()
+
+
+def test_appends_share_one_fsync(tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(importer.os, "fsync", lambda fd: (fsyncs.append(fd), real_fsync(fd)))
+    log = open_log(tmp_path, fsync_interval_ms=50)
+    durable = []
+    for i, row in enumerate(ROWS):
+        log.append([row], on_durable=lambda i=i: durable.append(i))
+    # Nothing is acknowledged before the group fsync
+    assert durable == [] and fsyncs == []
+    log.sync()
+    assert durable == list(range(len(ROWS)))
+    assert len(fsyncs) == 1
+    log.sync()
+    assert len(fsyncs) == 1
+    log.close()
+
+
+def test_zero_fsync_interval_syncs_every_append(tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(importer.os, "fsync", lambda fd: (fsyncs.append(fd), real_fsync(fd)))
+    log = open_log(tmp_path, fsync_interval_ms=0)
+    durable = []
+    log.append(ROWS[:1], on_durable=lambda: durable.append(1))
+    assert durable == [1] and len(fsyncs) == 1
+    log.close()